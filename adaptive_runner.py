@@ -0,0 +1,127 @@
+import asyncio
+import random
+import shlex
+import time
+import zlib
+
+from config_resolver import is_test_key
+
+PASSED = "PASS"
+FAILED = "FAIL"
+ERRORED = "ERROR"
+
+EXPANSION_PRIORITY = 0
+REPRESENTATIVE_PRIORITY = 1
+
+
+def command_runner(command_template, timeout=None):
+    # The template receives the test name, e.g. "nutest run --test {test}".
+    # A run is killed after timeout seconds, by default after the test's own
+    # resolved timeout.
+    async def run(test_case, execution_time):
+        command = command_template.format(test=shlex.quote(test_case))
+        limit = timeout if timeout is not None else (execution_time or None)
+        try:
+            process = await asyncio.create_subprocess_shell(
+                command, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        except OSError:
+            return ERRORED
+        try:
+            return_code = await asyncio.wait_for(process.wait(), limit)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            return ERRORED
+        return PASSED if return_code == 0 else FAILED
+    return run
+
+
+def stub_runner(fail_rate=0.0, time_scale=0.0, failures=(), seed=0):
+    # Local stand-in for a real runner: sleeps for a scaled execution time and
+    # fails the listed tests plus a deterministic fraction of the rest.
+    failures = set(failures)
+
+    async def run(test_case, execution_time):
+        await asyncio.sleep(execution_time * time_scale)
+        draw = random.Random(seed + zlib.crc32(test_case.encode())).random()
+        return FAILED if test_case in failures or draw < fail_rate else PASSED
+    return run
+
+
+async def run_adaptive(groups, execution_times, runner, workers=1, on_result=None, representatives=None, scores=None):
+    queue = asyncio.PriorityQueue()
+    results = {}
+    expanded = []
+    sequence = 0
+
+    # Only test keys are run; class entries in a cluster are config layers,
+    # and running one would run the whole class.
+    groups = {cluster_id: [test_case for test_case in group if is_test_key(test_case)]
+              for cluster_id, group in groups.items()}
+    cluster_of = {test_case: cluster_id for cluster_id, group in groups.items() for test_case in group}
+    if representatives is None:
+        representatives = [max(group, key=lambda test_case: execution_times[test_case])
+                           for group in groups.values() if group]
+    representative_set = set(representatives)
+    for representative in representatives:
+        queue.put_nowait((REPRESENTATIVE_PRIORITY, sequence, cluster_of[representative], representative))
+        sequence += 1
+
+    async def run_one(priority, cluster_id, test_case):
+        nonlocal sequence
+        started = time.monotonic()
+        try:
+            outcome = await runner(test_case, execution_times[test_case])
+        except Exception:
+            outcome = ERRORED
+        results[test_case] = (outcome, cluster_id, time.monotonic() - started)
+        if on_result:
+            on_result(test_case, outcome, cluster_id)
+        # A cluster may have several representatives; it is expanded once.
+        if priority == REPRESENTATIVE_PRIORITY and outcome != PASSED and cluster_id not in expanded:
+            expanded.append(cluster_id)
+            members = groups[cluster_id]
+            if scores is not None:
+                members = sorted(members, key=lambda member: -scores[member])
+            for member in members:
+                if member not in representative_set:
+                    queue.put_nowait((EXPANSION_PRIORITY, sequence, cluster_id, member))
+                    sequence += 1
+
+    async def worker():
+        while True:
+            priority, _, cluster_id, test_case = await queue.get()
+            # Whatever happens to the item, join() must not wait for it forever.
+            try:
+                await run_one(priority, cluster_id, test_case)
+            finally:
+                queue.task_done()
+
+    tasks = [asyncio.create_task(worker()) for _ in range(max(1, workers))]
+    joined = asyncio.create_task(queue.join())
+    try:
+        # A worker only finishes by raising, e.g. from on_result; that error is
+        # re-raised instead of leaving the remaining items unprocessed.
+        await asyncio.wait(tasks + [joined], return_when=asyncio.FIRST_COMPLETED)
+        for task in tasks:
+            if task.done():
+                raise task.exception()
+    finally:
+        for task in tasks + [joined]:
+            task.cancel()
+        await asyncio.gather(*tasks, joined, return_exceptions=True)
+
+    adaptive_execution_time = sum(execution_times[test_case] for test_case in results)
+    return results, expanded, adaptive_execution_time
+
+
+def print_result(test_case, outcome, cluster_id):
+    print("[{}] Cluster {}: {}".format(outcome, cluster_id, test_case))
+
+
+def execute_adaptive(groups, execution_times, runner, workers=1, representatives=None, scores=None):
+    results, expanded, adaptive_time = asyncio.run(
+        run_adaptive(groups, execution_times, runner, workers, print_result, representatives, scores))
+    print("Expanded Clusters: {}".format(", ".join(str(cluster_id) for cluster_id in expanded) or "none"))
+    print("Adaptive Execution Time: {} seconds".format(adaptive_time))
+    return results, expanded, adaptive_time
@@ -0,0 +1,372 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import numpy_backend
+import out_of_core
+import profiling
+from catalogue import Catalogue
+from config_resolver import is_test_key, resolve_test_cases
+from coverage_selection import coverage_items
+from field_vectors import DEFAULT_FIELD_WEIGHTS
+from hashing_vectorizer import DocumentFrequencies
+from profiling import span
+from projection import Projection
+from sharded_clustering import sharded_kmeans, start_local_workers, weighted_inertia
+from source_index import load_source_index
+from synthetic_catalogue import write_config
+from test_optimization import (DEFAULT_SHARD_DIMS, combine_attributes, cosine_similarity, extract_test_cases,
+                               fit_unique_vectors, kmeans_clustering, kmeans_fit, load_config,
+                               measure_execution_time, select_representatives, threshold_clustering)
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000, 1000000]
+QUALITY_SIZES = [1000, 5000]
+SHARDING_SIZES = [5000, 20000]
+SHARD_COUNTS = [2, 4, 8]
+SCALING_DIMS = 64
+EMULATED_HOSTS = 2
+BUNDLED_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
+# The similarity matrix is dense n x n; beyond this many tests it does not fit.
+MAX_DENSE_TESTS = 20000
+# Above this many tests the catalogue is not loaded at all but streamed
+# through out_of_core.py.
+MAX_IN_MEMORY_TESTS = 200000
+
+
+def stage_records(profiler):
+    stages = {}
+    for record in profiler.records:
+        stages[record["name"]] = {"wall": record["wall"], "cpu": record["cpu"],
+                                  "max_rss_kb": record["max_rss_kb"], "rss_growth_kb": record["rss_growth_kb"],
+                                  "items": record["items"]}
+    return stages
+
+
+def cluster_in_memory(config_path, num_clusters, max_dense):
+    # The optimizer's in-memory path for this size; returns its name and the
+    # number of test entries.
+    with span("load") as stage:
+        config = load_config(config_path)
+        test_cases = extract_test_cases(config)
+        stage.count(len(test_cases))
+    with span("catalogue") as stage:
+        catalogue = Catalogue(test_cases, resolve_test_cases(config))
+        stage.count(len(catalogue))
+    with span("calculate_similarity"):
+        if len(test_cases) <= max_dense:
+            # The default pipeline: unique rows, weighted similarity rows.
+            path = "dense"
+            vectors, weights, inverse, _ = fit_unique_vectors(test_cases)
+            features = cosine_similarity(vectors) * np.sqrt(weights)
+        else:
+            # As with --hashing and --reduce-dims: sparse hashed rows
+            # projected before k-means, never an n x n matrix.
+            path = "hashing"
+            workers = os.cpu_count() or 1
+            with span("document_frequencies") as stage:
+                document_frequencies = DocumentFrequencies()
+                document_frequencies.sync({key: combine_attributes(test_cases[key]) for key in test_cases}, workers)
+                stage.count(len(document_frequencies))
+            projection = Projection("random", SCALING_DIMS)
+            features, weights, inverse, _ = fit_unique_vectors(test_cases, projection=projection,
+                                                               document_frequencies=document_frequencies,
+                                                               featurize_workers=workers)
+    labels = kmeans_fit(features, num_clusters, weights, inverse)
+    with span("measure_execution_time") as stage:
+        stage.count(len(test_cases))
+        measure_execution_time(labels, catalogue.cost)
+    return path, len(test_cases)
+
+
+def run_scaling_size(size, workdir, num_clusters=8, seed=0, max_dense=MAX_DENSE_TESTS,
+                     max_in_memory=MAX_IN_MEMORY_TESTS):
+    # Each size runs the path the optimizer takes at that size: n x n
+    # similarity rows, projected hashed vectors, or out_of_core.py.
+    config_path = os.path.join(workdir, "synthetic_{}.json".format(size))
+    if not os.path.exists(config_path):
+        write_config(config_path, size, seed)
+
+    profiler = profiling.enable()
+    try:
+        if size > max_in_memory:
+            # A fresh work directory, so no stage is resumed from a checkpoint.
+            checkpoint_dir = tempfile.mkdtemp(prefix="out_of_core_", dir=workdir)
+            try:
+                with span("out_of_core"):
+                    out_of_core.run(config_path, checkpoint_dir, num_clusters, dims=SCALING_DIMS, seed=seed)
+            finally:
+                shutil.rmtree(checkpoint_dir)
+            path, num_tests = "out_of_core", None
+        else:
+            path, num_tests = cluster_in_memory(config_path, num_clusters, max_dense)
+    finally:
+        profiling.disable()
+    stages = stage_records(profiler)
+    if num_tests is None:
+        num_tests = stages["parse"]["items"]
+    return {"size": size, "test_cases": num_tests, "path": path, "stages": stages,
+            "peak_rss_kb": profiling.peak_rss_kb()}
+
+
+def labels_to_clusters(labels, test_case_keys):
+    clusters = {}
+    for idx, label in enumerate(labels):
+        clusters.setdefault(int(label), []).append(test_case_keys[idx])
+    return clusters
+
+
+def numpy_clusters(test_cases, num_clusters):
+    keys = list(test_cases)
+    vectors = numpy_backend.TfidfVectorizer().fit_transform([combine_attributes(test_cases[key]) for key in keys])
+    similarity_matrix = numpy_backend.cosine_similarity(vectors)
+    return labels_to_clusters(numpy_backend.KMeans(num_clusters, random_state=0).fit(similarity_matrix).labels_, keys)
+
+
+def sklearn_clusters(test_cases, num_clusters):
+    from sklearn.cluster import KMeans
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics.pairwise import cosine_similarity
+    keys = list(test_cases)
+    vectors = TfidfVectorizer().fit_transform([combine_attributes(test_cases[key]) for key in keys])
+    return labels_to_clusters(KMeans(num_clusters, random_state=0).fit(cosine_similarity(vectors)).labels_, keys)
+
+
+def field_clusters(test_cases, num_clusters):
+    vectors, weights, inverse, keys = fit_unique_vectors(test_cases, DEFAULT_FIELD_WEIGHTS)
+    return kmeans_clustering(cosine_similarity(vectors), keys, num_clusters, weights, inverse)
+
+
+def threshold_clusters(test_cases, num_clusters):
+    # Ignores num_clusters: the cluster count follows from the threshold.
+    vectors, weights, inverse, keys = fit_unique_vectors(test_cases)
+    return threshold_clustering(vectors, keys, 0.9, None, weights, inverse)
+
+
+def hashing_clusters(test_cases, num_clusters):
+    document_frequencies = DocumentFrequencies()
+    document_frequencies.sync({key: combine_attributes(test_cases[key]) for key in test_cases})
+    vectors, weights, inverse, keys = fit_unique_vectors(test_cases, document_frequencies=document_frequencies)
+    return kmeans_clustering(cosine_similarity(vectors), keys, num_clusters, weights, inverse)
+
+
+# Every backend maps (test_cases, num_clusters) to the dict-of-lists clusters
+# that kmeans_clustering returns.
+CLUSTERING_BACKENDS = {
+    "numpy": numpy_clusters,
+    "sklearn": sklearn_clusters,
+    "threshold": threshold_clusters,
+    "fields": field_clusters,
+    "hashing": hashing_clusters,
+}
+
+
+def adjusted_rand_index(labels_true, labels_pred):
+    _, true_ids = np.unique(labels_true, return_inverse=True)
+    _, pred_ids = np.unique(labels_pred, return_inverse=True)
+    contingency = np.zeros((true_ids.max() + 1, pred_ids.max() + 1), dtype=np.int64)
+    np.add.at(contingency, (true_ids, pred_ids), 1)
+
+    def pairs(counts):
+        return float((counts * (counts - 1) // 2).sum())
+
+    index = pairs(contingency)
+    true_pairs = pairs(contingency.sum(axis=1))
+    pred_pairs = pairs(contingency.sum(axis=0))
+    expected = true_pairs * pred_pairs / pairs(np.array([len(true_ids)]))
+    maximum = (true_pairs + pred_pairs) / 2.0
+    return 1.0 if maximum == expected else (index - expected) / (maximum - expected)
+
+
+def ground_truth(catalogue):
+    # Variant families (test_x, test_x___esx, test_x___xi, ...) share a base
+    # method; variant kinds (___esx across all methods) share a topology.
+    return catalogue.families(), catalogue.variant
+
+
+def score_backend(name, test_cases, resolved_tests, items, num_clusters):
+    keys = list(test_cases)
+    # Untimed warm-up on a slice so lazy imports are not billed to the backend.
+    warm_up = {key: test_cases[key] for key in keys[:2 * num_clusters]}
+    CLUSTERING_BACKENDS[name](warm_up, min(num_clusters, len(warm_up)))
+    tracemalloc.start()
+    started = time.perf_counter()
+    clusters = CLUSTERING_BACKENDS[name](test_cases, num_clusters)
+    runtime = time.perf_counter() - started
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    label_of = {key: cluster_id for cluster_id, group in clusters.items() for key in group}
+    labels = [label_of[key] for key in keys]
+    catalogue = Catalogue(test_cases, resolved_tests)
+    families, variants = ground_truth(catalogue)
+    execution_times = dict(zip(catalogue.names.strings, catalogue.cost.tolist()))
+    representatives = select_representatives(clusters, execution_times)
+    full_items = set().union(*items.values()) if items else set()
+    kept_items = set().union(*(items[key] for key in representatives)) if representatives else set()
+    normal_time = sum(execution_times.values())
+    return {
+        "backend": name,
+        "ari_family": adjusted_rand_index(families, labels),
+        "ari_variant": adjusted_rand_index(variants, labels),
+        "coverage_loss": 1.0 - len(kept_items) / float(len(full_items)) if full_items else 0.0,
+        "time_saved": 1.0 - sum(execution_times[key] for key in representatives) / float(normal_time)
+        if normal_time else 0.0,
+        "runtime": runtime,
+        "peak_memory_kb": peak_memory // 1024,
+    }
+
+
+def pareto_front(scores):
+    # Higher ARI and time saved are better; lower coverage loss, runtime and
+    # memory are better.
+    def objectives(score):
+        return (score["ari_family"], score["ari_variant"], -score["coverage_loss"], score["time_saved"],
+                -score["runtime"], -score["peak_memory_kb"])
+
+    front = []
+    for score in scores:
+        dominated = any(all(a >= b for a, b in zip(objectives(other), objectives(score)))
+                        and objectives(other) != objectives(score) for other in scores)
+        front.append(not dominated)
+    return front
+
+
+def run_quality(config_path, num_clusters=8, backends=None):
+    config = load_config(config_path)
+    test_cases = {key: entry for key, entry in extract_test_cases(config).items() if is_test_key(key)}
+    resolved_tests = resolve_test_cases(config)
+    source_index = load_source_index(os.path.dirname(config_path), resolved_tests)
+    items = {key: coverage_items(resolved_tests[key], source_index.get(key)) for key in test_cases}
+    num_clusters = min(num_clusters, len(test_cases))
+    scores = [score_backend(name, test_cases, resolved_tests, items, num_clusters)
+              for name in (backends or CLUSTERING_BACKENDS)]
+    for score, on_front in zip(scores, pareto_front(scores)):
+        score["pareto"] = on_front
+    return {"config": config_path, "test_cases": len(test_cases), "scores": scores}
+
+
+def print_quality(result):
+    print("{} ({} tests)".format(result["config"], result["test_cases"]))
+    print("  {:<12} {:>10} {:>11} {:>13} {:>10} {:>10} {:>10} {:>6}".format(
+        "backend", "ARI/family", "ARI/variant", "coverage loss", "time saved", "runtime", "memory", "pareto"))
+    for score in result["scores"]:
+        print("  {:<12} {:>10.3f} {:>11.3f} {:>13.1%} {:>10.1%} {:>9.3f}s {:>8.1f}MB {:>6}".format(
+            score["backend"], score["ari_family"], score["ari_variant"], score["coverage_loss"],
+            score["time_saved"], score["runtime"], score["peak_memory_kb"] / 1024.0, "*" if score["pareto"] else ""))
+
+
+def run_sharding(config_path, num_clusters=8):
+    # Sharded k-means against single-node k-means on the projected vectors
+    # --shards clusters by default: label agreement (ARI over all tests) and the inertia ratio.
+    # Shards run in local processes, then over the socket protocol against
+    # localhost stand-ins for remote hosts.
+    test_cases = extract_test_cases(load_config(config_path))
+    vectors, weights, inverse, _ = fit_unique_vectors(test_cases, projection=Projection("random", DEFAULT_SHARD_DIMS))
+    num_clusters = min(num_clusters, len(weights))
+    started = time.perf_counter()
+    single_labels = kmeans_fit(vectors, num_clusters, weights)
+    single = {"shards": 1, "workers": "single node", "runtime": time.perf_counter() - started,
+              "ari": 1.0, "inertia_ratio": 1.0}
+    single_inertia = weighted_inertia(vectors, single_labels, weights)
+
+    def score(shards, workers, hosts=None):
+        started = time.perf_counter()
+        labels = sharded_kmeans(vectors, num_clusters, weights, shards, hosts=hosts)[0]
+        return {"shards": shards, "workers": workers, "runtime": time.perf_counter() - started,
+                "ari": adjusted_rand_index(single_labels[inverse], labels[inverse]),
+                "inertia_ratio": weighted_inertia(vectors, labels, weights) / single_inertia if single_inertia else 1.0}
+
+    scores = [single] + [score(shards, "local processes") for shards in SHARD_COUNTS]
+    servers, hosts = start_local_workers(EMULATED_HOSTS)
+    try:
+        scores += [score(shards, "{} localhost hosts".format(EMULATED_HOSTS), hosts) for shards in SHARD_COUNTS]
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+    return {"config": config_path, "test_cases": len(inverse), "unique": len(weights), "scores": scores}
+
+
+def print_sharding(result):
+    print("{} ({} tests, {} unique)".format(result["config"], result["test_cases"], result["unique"]))
+    print("  {:>6} {:<20} {:>12} {:>14} {:>10}".format("shards", "workers", "ARI/single", "inertia ratio", "runtime"))
+    for score in result["scores"]:
+        print("  {:>6} {:<20} {:>12.3f} {:>14.3f} {:>9.3f}s".format(
+            score["shards"], score["workers"], score["ari"], score["inertia_ratio"], score["runtime"]))
+
+
+def run_isolated(mode, size, workdir, extra_args=()):
+    # One process per size so that peak RSS belongs to that size alone.
+    command = [sys.executable, os.path.abspath(__file__), mode, "--one", str(size), "--workdir", workdir]
+    output = subprocess.check_output(command + list(extra_args), text=True)
+    return json.loads(output.splitlines()[-1])
+
+
+def print_scaling(result):
+    stages = ", ".join("{} {:.3f}s".format(name, stage["wall"]) for name, stage in result["stages"].items())
+    print("{:>8} tests ({}): {} | peak RSS {:.0f} MB".format(result["size"], result["path"], stages,
+                                                            result["peak_rss_kb"] / 1024.0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='benchmark the optimization pipeline on synthetic catalogues')
+    parser.add_argument('mode', choices=['scaling', 'quality', 'sharding'])
+    parser.add_argument('--sizes', type=int, nargs='+')
+    parser.add_argument('--config', help='real config scored alongside the synthetic sizes, by default config.json')
+    parser.add_argument('--clusters', type=int, default=8)
+    parser.add_argument('--backends', nargs='+', choices=sorted(CLUSTERING_BACKENDS))
+    parser.add_argument('--workdir', help='where synthetic configs are generated and reused')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--max-dense', type=int, default=MAX_DENSE_TESTS,
+                        help='largest size clustered on similarity rows; larger sizes use projected hashed vectors')
+    parser.add_argument('--max-in-memory', type=int, default=MAX_IN_MEMORY_TESTS,
+                        help='largest size loaded into memory; larger sizes are streamed through out_of_core.py')
+    parser.add_argument('--one', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="test_optimization_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    if args.one is not None:
+        print(json.dumps(run_scaling_size(args.one, workdir, args.clusters, max_dense=args.max_dense,
+                                          max_in_memory=args.max_in_memory)))
+        sys.exit(0)
+
+    if args.mode in ('quality', 'sharding'):
+        config_paths = [args.config or BUNDLED_CONFIG_PATH]
+        for size in args.sizes or (QUALITY_SIZES if args.mode == 'quality' else SHARDING_SIZES):
+            config_path = os.path.join(workdir, "synthetic_{}.json".format(size))
+            if not os.path.exists(config_path):
+                write_config(config_path, size)
+            config_paths.append(config_path)
+        results = []
+        for config_path in config_paths:
+            if args.mode == 'quality':
+                result = run_quality(config_path, args.clusters, args.backends)
+                print_quality(result)
+            else:
+                result = run_sharding(config_path, args.clusters)
+                print_sharding(result)
+            results.append(result)
+        with open(args.output, 'w') as file:
+            json.dump({"mode": args.mode, "results": results}, file, indent=2)
+        print("Results written to {}".format(args.output))
+        sys.exit(0)
+
+    results = []
+    for size in args.sizes or DEFAULT_SIZES:
+        result = run_isolated(args.mode, size, workdir, ["--clusters", str(args.clusters),
+                                                         "--max-dense", str(args.max_dense),
+                                                         "--max-in-memory", str(args.max_in_memory)])
+        print_scaling(result)
+        results.append(result)
+    with open(args.output, 'w') as file:
+        json.dump({"mode": args.mode, "results": results}, file, indent=2)
+    print("Results written to {}".format(args.output))
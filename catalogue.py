@@ -0,0 +1,84 @@
+import sys
+
+import numpy as np
+
+from config_resolver import split_test_key
+from coverage_selection import hypervisor_combo
+
+ID_DTYPE = np.int32
+
+
+class StringTable(object):
+    # Interned strings numbered in first-seen order.
+    def __init__(self):
+        self.strings = []
+        self.ids = {}
+
+    def intern(self, string):
+        string_id = self.ids.get(string)
+        if string_id is None:
+            string = sys.intern(string)
+            string_id = self.ids[string] = len(self.strings)
+            self.strings.append(string)
+        return string_id
+
+    def __getitem__(self, string_id):
+        return self.strings[string_id]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class Catalogue(object):
+    # Every test is an int32 row id; its attributes are parallel arrays of ids
+    # into interned string tables. Stages work on these arrays and names are
+    # looked up only when something is printed or handed to a name-based stage.
+    # Topology and cost come from resolved_tests, the entries merged with their
+    # global, class and base-method layers (resolve_test_cases); class entries
+    # are layers rather than runnable tests and cost nothing.
+    COLUMNS = ("suite", "class_name", "method", "variant", "topology")
+
+    def __init__(self, test_cases, resolved_tests):
+        self.names = StringTable()
+        self.tables = {column: StringTable() for column in self.COLUMNS}
+        columns = {column: [] for column in self.COLUMNS}
+        costs = []
+        runnable = []
+        for key, entry in test_cases.items():
+            self.names.intern(key)
+            suite, module, class_name, method, variant = split_test_key(key)
+            resolved = resolved_tests.get(key)
+            specs = (resolved or entry).get("resource_spec") or []
+            values = (suite + "." + module if suite else module, class_name, method, variant,
+                      ",".join(hypervisor_combo(spec) for spec in specs))
+            for column, value in zip(self.COLUMNS, values):
+                columns[column].append(self.tables[column].intern(value))
+            costs.append(resolved.get('test_timeout', 0) if resolved is not None else 0)
+            runnable.append(resolved is not None)
+        self.ids = np.arange(len(self.names), dtype=ID_DTYPE)
+        for column in self.COLUMNS:
+            setattr(self, column, np.asarray(columns[column], dtype=ID_DTYPE))
+        self.cost = np.asarray(costs) if costs else np.zeros(0, dtype=np.int64)
+        self.runnable = np.asarray(runnable, dtype=bool)
+
+    def __len__(self):
+        return len(self.names)
+
+    def ids_of(self, names):
+        return np.asarray([self.names.ids[name] for name in names], dtype=ID_DTYPE)
+
+    def names_of(self, ids):
+        return [self.names[test_id] for test_id in ids]
+
+    def families(self, ids=None):
+        # Family id of each test: variants of one test method share it.
+        ids = self.ids if ids is None else ids
+        keys = np.stack([self.suite[ids], self.class_name[ids], self.method[ids]]).astype(np.int64)
+        return np.unique(keys, axis=1, return_inverse=True)[1].ravel()
+
+    def groups(self, labels):
+        # {cluster: [test names]} for labels 0..max, empty clusters included.
+        clusters = {label: [] for label in range(int(labels.max()) + 1 if len(labels) else 0)}
+        for test_id, label in enumerate(labels.tolist()):
+            clusters[label].append(self.names[test_id])
+        return clusters
@@ -0,0 +1,185 @@
+import ast
+import hashlib
+import json
+import os
+import re
+import subprocess
+
+from config_resolver import split_test_key
+from source_index import index_test_module
+
+INDEX_VERSION = 1
+HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+
+def file_digest(path):
+    with open(path, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def load_impact_index(index_path):
+    if index_path and os.path.exists(index_path):
+        with open(index_path, 'r') as file:
+            index = json.load(file)
+        if index.get("version") == INDEX_VERSION:
+            return index
+    return {"version": INDEX_VERSION, "modules": {}, "reverse": {}, "tests": None}
+
+
+def save_impact_index(index, index_path):
+    with open(index_path + ".tmp", 'w') as file:
+        json.dump(index, file)
+    os.replace(index_path + ".tmp", index_path)
+
+
+def test_keys_digest(test_keys):
+    return hashlib.sha1("\n".join(sorted(test_keys)).encode()).hexdigest()
+
+
+def update_impact_index(index, source_dir, test_keys):
+    # Re-parses only test modules whose mtime and content hash both moved; the
+    # reverse index is rebuilt when a module or the set of test keys changed.
+    modules = sorted({split_test_key(key)[1] for key in test_keys})
+    changed = False
+    for module in modules:
+        path = os.path.join(source_dir, module + ".py")
+        cached = index["modules"].get(module)
+        if not os.path.exists(path):
+            changed = changed or cached is not None
+            index["modules"].pop(module, None)
+            continue
+        mtime = os.path.getmtime(path)
+        if cached and cached["mtime"] == mtime:
+            continue
+        digest = file_digest(path)
+        if cached and cached["sha1"] == digest:
+            cached["mtime"] = mtime
+            continue
+        index["modules"][module] = {"mtime": mtime, "sha1": digest, "classes": index_test_module(path)}
+        changed = True
+
+    keys_digest = test_keys_digest(test_keys)
+    if changed or index.get("tests") != keys_digest:
+        reverse = {}
+        for key in test_keys:
+            _, module, class_name, method, _ = split_test_key(key)
+            entry = index["modules"].get(module, {}).get("classes", {}).get(class_name, {}).get(method)
+            for call in (entry or {}).get("calls", []):
+                reverse.setdefault(call, []).append(key)
+        index["reverse"] = reverse
+        index["tests"] = keys_digest
+    return index
+
+
+def git_changed_files(repo_root, revision):
+    output = subprocess.check_output(["git", "diff", "--name-only", revision], cwd=repo_root, text=True)
+    return [line for line in output.splitlines() if line.endswith(".py")]
+
+
+def git_changed_lines(repo_root, revision):
+    output = subprocess.check_output(["git", "diff", "-U0", revision, "--", "*.py"], cwd=repo_root, text=True)
+    # A deleted module (+++ /dev/null) changes as a whole, as in name-only
+    # mode: its path is the preceding --- a/ line and it has no line ranges.
+    changed = {}
+    path = old_path = None
+    for line in output.splitlines():
+        if line.startswith("--- "):
+            old_path = line[6:] if line.startswith("--- a/") else None
+        elif line.startswith("+++ "):
+            path = line[6:] if line.startswith("+++ b/") else None
+            if path is not None:
+                changed.setdefault(path, [])
+            elif old_path is not None:
+                changed[old_path] = None
+        elif path is not None:
+            match = HUNK_HEADER.match(line)
+            if match:
+                start, count = int(match.group(1)), int(match.group(2) or 1)
+                changed[path].append((start, start + max(count, 1) - 1))
+    return changed
+
+
+def module_name(path):
+    return os.path.splitext(path)[0].replace(os.sep, ".").replace("/", ".")
+
+
+def changed_functions(repo_root, path, line_ranges=None):
+    # Qualified names of the functions a change touches; a change outside any
+    # function (imports, constants, class bodies) touches the whole module.
+    module = module_name(path)
+    full_path = os.path.join(repo_root, path)
+    if line_ranges is None or not os.path.exists(full_path):
+        return {module}
+    with open(full_path, 'r') as file:
+        tree = ast.parse(file.read(), filename=full_path)
+
+    definitions = []
+
+    def visit(node, prefix):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                name = "{}.{}".format(prefix, child.name)
+                if child.name == "__init__":
+                    name = prefix
+                start = min([child.lineno] + [decorator.lineno for decorator in child.decorator_list])
+                definitions.append((start, child.end_lineno, name))
+            elif isinstance(child, ast.ClassDef):
+                visit(child, "{}.{}".format(prefix, child.name))
+
+    visit(tree, module)
+    functions = set()
+    for start, end in line_ranges:
+        hits = [name for def_start, def_end, name in definitions if def_start <= end and start <= def_end]
+        if not hits:
+            return {module}
+        functions.update(hits)
+    return functions
+
+
+def affected_tests(index, functions):
+    affected = set()
+    for call, test_keys in index["reverse"].items():
+        if any(call == function or call.startswith(function + ".") for function in functions):
+            affected.update(test_keys)
+    return affected
+
+
+def affected_test_modules(index, repo_root, source_dir, changed):
+    # Editing a test module affects the tests in it, at method granularity when
+    # line ranges are known.
+    affected = set()
+    for path, line_ranges in changed.items():
+        full_path = os.path.abspath(os.path.join(repo_root, path))
+        if os.path.dirname(full_path) != os.path.abspath(source_dir):
+            continue
+        module = os.path.splitext(os.path.basename(path))[0]
+        for class_name, methods in index["modules"].get(module, {}).get("classes", {}).items():
+            for method, entry in methods.items():
+                start, end = entry["lines"]
+                if line_ranges is None or any(lo <= end and start <= hi for lo, hi in line_ranges):
+                    affected.add((module, class_name, method))
+    return affected
+
+
+def select_impacted_tests(test_keys, source_dir, revision, repo_root=None, index_path=None, by_lines=False):
+    repo_root = repo_root or subprocess.check_output(
+        ["git", "rev-parse", "--show-toplevel"], cwd=source_dir or ".", text=True).strip()
+    index = update_impact_index(load_impact_index(index_path), source_dir, test_keys)
+    if index_path:
+        save_impact_index(index, index_path)
+
+    if by_lines:
+        changed = git_changed_lines(repo_root, revision)
+    else:
+        changed = dict.fromkeys(git_changed_files(repo_root, revision))
+    functions = set()
+    for path, line_ranges in changed.items():
+        functions |= changed_functions(repo_root, path, line_ranges)
+
+    affected = affected_tests(index, functions)
+    touched_methods = affected_test_modules(index, repo_root, source_dir, changed)
+    for key in test_keys:
+        _, module, class_name, method, _ = split_test_key(key)
+        if (module, class_name, method) in touched_methods:
+            affected.add(key)
+    return [key for key in test_keys if key in affected], sorted(functions)
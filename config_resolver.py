@@ -0,0 +1,87 @@
+import copy
+
+VARIANT_SEPARATOR = "___"
+
+
+def is_test_key(key):
+    return key.rsplit(".", 1)[-1].startswith("test_")
+
+
+def split_test_key(key):
+    parts = key.split(".")
+    if not is_test_key(key):
+        return ".".join(parts[:-2]), parts[-2], parts[-1], "", ""
+    method, _, variant = parts[-1].partition(VARIANT_SEPARATOR)
+    return ".".join(parts[:-3]), parts[-3], parts[-2], method, variant
+
+
+def class_key(key):
+    return key.rsplit(".", 1)[0] if is_test_key(key) else key
+
+
+def base_method_key(key):
+    return key.split(VARIANT_SEPARATOR, 1)[0]
+
+
+def deep_merge(base, override):
+    if not isinstance(base, dict) or not isinstance(override, dict):
+        return copy.deepcopy(override)
+    merged = copy.deepcopy(base)
+    for key, value in override.items():
+        merged[key] = deep_merge(merged[key], value) if key in merged else copy.deepcopy(value)
+    return merged
+
+
+def merge_resource_spec_by_name(inherited, override):
+    merged = [copy.deepcopy(spec) for spec in inherited]
+    for spec in override:
+        for idx, existing in enumerate(merged):
+            if existing.get("name") == spec.get("name"):
+                merged[idx] = deep_merge(existing, spec)
+                break
+        else:
+            merged.append(copy.deepcopy(spec))
+    return merged
+
+
+def apply_layer(resolved, layer):
+    for key, value in layer.items():
+        if key.startswith("merge_"):
+            continue
+        if key == "resource_spec" and layer.get("merge_resource_spec_by_name"):
+            resolved[key] = merge_resource_spec_by_name(resolved.get(key, []), value)
+        elif key == "expected_fatals" and layer.get("merge_expected_fatals"):
+            resolved[key] = resolved.get(key, []) + copy.deepcopy(value)
+        elif key == "test_args":
+            resolved[key] = dict(resolved.get(key, {}), **copy.deepcopy(value))
+        elif key == "pre_run":
+            resolved[key] = resolved.get(key, []) + copy.deepcopy(value)
+        else:
+            resolved[key] = copy.deepcopy(value)
+    return resolved
+
+
+def config_layers(config, key):
+    test_config = config.get("test_config", {})
+    layers = [config.get("global_config", {})]
+    keys = [class_key(key)]
+    if is_test_key(key):
+        if base_method_key(key) != key:
+            keys.append(base_method_key(key))
+        keys.append(key)
+    for layer_key in keys:
+        if layer_key in test_config:
+            layers.append(test_config[layer_key])
+    return layers
+
+
+def resolve_test_case(config, key):
+    resolved = {}
+    for layer in config_layers(config, key):
+        apply_layer(resolved, layer)
+    return resolved
+
+
+def resolve_test_cases(config):
+    return {key: resolve_test_case(config, key)
+            for key in config.get("test_config", {}) if is_test_key(key)}
@@ -0,0 +1,118 @@
+import copy
+import json
+import sys
+
+
+# Hash-consed JSON: while a config is parsed, every object and array is looked
+# up by its contents, so identical subtrees (expected_fatals
+# lists, Metadata blocks, resource_spec templates) become one shared,
+# immutable node. Memory then grows with the number of distinct subtrees, and
+# per-node caches such as canonical_json() run once per distinct subtree.
+def immutable(self, *args, **kwargs):
+    raise TypeError("hash-consed config nodes are immutable; copy.deepcopy() one to edit it")
+
+
+class FrozenDict(dict):
+    __slots__ = ("key_hash", "text")
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = immutable
+    __ior__ = immutable
+
+    def __init__(self, pairs, key_hash):
+        dict.__init__(self, pairs)
+        self.key_hash = key_hash
+        self.text = None
+
+    def __hash__(self):
+        return self.key_hash
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return {key: copy.deepcopy(value, memo) for key, value in self.items()}
+
+    def __reduce__(self):
+        return FrozenDict, (list(self.items()), self.key_hash)
+
+
+class FrozenList(list):
+    __slots__ = ("key_hash", "text")
+    __setitem__ = __delitem__ = append = extend = insert = pop = remove = clear = sort = reverse = immutable
+    __iadd__ = __imul__ = immutable
+
+    def __init__(self, items, key_hash):
+        list.__init__(self, items)
+        self.key_hash = key_hash
+        self.text = None
+
+    def __hash__(self):
+        return self.key_hash
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(value, memo) for value in self]
+
+    def __reduce__(self):
+        return FrozenList, (list(self), self.key_hash)
+
+
+NODE_TYPES = (FrozenDict, FrozenList)
+
+
+class ConfigStore(object):
+    # Nodes are keyed by their kind and their children: a child node by its
+    # identity (children are interned first), a scalar by its type and value
+    # so that true, 1 and "1" stay apart. Key order is part of the key, so
+    # the shared node always serialises exactly like each of its copies.
+    def __init__(self):
+        self.nodes = {}
+        self.lookups = 0
+
+    def intern(self, node_type, items, key):
+        self.lookups += 1
+        node = self.nodes.get(key)
+        if node is None:
+            node = self.nodes[key] = node_type(items, hash(key))
+        return node
+
+    def children(self, values):
+        # Interns list values in place (arrays bypass the parser hook) and
+        # returns the key parts of all values.
+        parts = []
+        for idx, value in enumerate(values):
+            value_type = type(value)
+            if value_type is list:
+                value = values[idx] = self.array(value)
+                parts.append(id(value))
+            elif value_type is FrozenDict or value_type is FrozenList:
+                parts.append(id(value))
+            elif value_type is str:
+                value = values[idx] = sys.intern(value)
+                parts.append(value)
+            else:
+                parts.append((value_type, value))
+        return parts
+
+    def array(self, items):
+        return self.intern(FrozenList, items, ("[",) + tuple(self.children(items)))
+
+    def object_pairs(self, pairs):
+        names, values = zip(*pairs) if pairs else ((), ())
+        values = list(values)
+        key = ("{",) + names + tuple(self.children(values))
+        return self.intern(FrozenDict, zip(names, values), key)
+
+    def load(self, file):
+        config = json.load(file, object_pairs_hook=self.object_pairs)
+        return self.array(config) if type(config) is list else config
+
+
+def canonical_json(value):
+    # json.dumps(value, sort_keys=True), computed once per hash-consed node.
+    if isinstance(value, (FrozenDict, FrozenList)):
+        if value.text is None:
+            value.text = json.dumps(value, sort_keys=True)
+        return value.text
+    return json.dumps(value, sort_keys=True)
@@ -0,0 +1,49 @@
+import numpy as np
+
+
+# Grouped cost statistics over label arrays. Counts and totals are bincounts;
+# the longest test per cluster is a maximum over cost ranks, which yields the
+# maximum and its argmax from one scatter. A batch of clusterings is costed
+# at once by offsetting each clustering's labels into its own range.
+def cost_ranks(costs):
+    # The highest rank is the longest test; among equal costs the earliest
+    # test ranks highest, matching max() over a group in test order.
+    order = np.lexsort((-np.arange(len(costs)), costs))
+    ranks = np.empty(len(costs), dtype=np.int64)
+    ranks[order] = np.arange(len(costs))
+    return order, ranks
+
+
+def group_costs(labels, costs, num_clusters=None, ranks=None):
+    # Per cluster: member count, total cost, longest cost and its test id
+    # (-1 for empty clusters).
+    labels = np.asarray(labels, dtype=np.int64)
+    if num_clusters is None:
+        num_clusters = int(labels.max()) + 1 if len(labels) else 0
+    order, ranks = cost_ranks(costs) if ranks is None else ranks
+    counts = np.bincount(labels, minlength=num_clusters)
+    totals = np.bincount(labels, weights=costs, minlength=num_clusters)
+    top = np.full(num_clusters, -1, dtype=np.int64)
+    np.maximum.at(top, labels, ranks)
+    filled = top >= 0
+    argmax = np.full(num_clusters, -1, dtype=np.int64)
+    argmax[filled] = order[top[filled]]
+    maxima = np.zeros(num_clusters, dtype=np.result_type(costs, 0))
+    maxima[filled] = costs[argmax[filled]]
+    return counts, totals, maxima, argmax
+
+
+def clustering_costs(label_matrix, costs, num_clusters=None):
+    # Optimized time (sum of the longest test per cluster) of every row of
+    # label_matrix, plus the (rows, clusters) matrix of longest test ids.
+    label_matrix = np.atleast_2d(np.asarray(label_matrix, dtype=np.int64))
+    num_clusterings = label_matrix.shape[0]
+    if num_clusters is None:
+        num_clusters = int(label_matrix.max()) + 1 if label_matrix.size else 0
+    codes = (label_matrix + np.arange(num_clusterings)[:, np.newaxis] * num_clusters).ravel()
+    # Ranks only compete within one code, so every clustering reuses them.
+    order, ranks = cost_ranks(costs)
+    _, _, maxima, argmax = group_costs(codes, np.tile(costs, num_clusterings), num_clusterings * num_clusters,
+                                       (order, np.tile(ranks, num_clusterings)))
+    return (maxima.reshape(num_clusterings, num_clusters).sum(axis=1),
+            argmax.reshape(num_clusterings, num_clusters))
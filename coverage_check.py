@@ -0,0 +1,107 @@
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from config_resolver import resolve_test_cases
+from coverage_selection import build_coverage, coverage_items, subset_rows
+
+CANDIDATES_PER_ITEM = 3
+
+
+def topology_fingerprint(spec):
+    return hashlib.blake2b(json.dumps(spec, sort_keys=True).encode(), digest_size=6).hexdigest()
+
+
+def plan_items(resolved, source_entry=None):
+    # Everything coverage_items tracks plus the exact resolved topology, so a
+    # plan that keeps the hypervisor combination but drops a topology variant
+    # is still caught.
+    items = coverage_items(resolved, source_entry)
+    items.update("topology:" + topology_fingerprint(spec) for spec in resolved.get("resource_spec", []))
+    return items
+
+
+def pack_bitsets(indptr, indices, num_items, rows=None):
+    # One row of uint64 words per test; bit i of a row is set when the test
+    # covers item i.
+    if rows is None:
+        rows = np.arange(len(indptr) - 1)
+    rows = np.asarray(rows, dtype=np.int64)
+    sub_indptr, items = subset_rows(indptr, indices, rows)
+    owners = np.repeat(np.arange(len(rows)), np.diff(sub_indptr))
+    bits = np.zeros((len(rows), (num_items + 63) // 64), dtype=np.uint64)
+    np.bitwise_or.at(bits, (owners, items >> 6), np.left_shift(np.uint64(1), (items & 63).astype(np.uint64)))
+    return bits
+
+
+def pack_items(items, num_items):
+    present = np.zeros(((num_items + 63) // 64) * 64, dtype=bool)
+    present[items] = True
+    return np.packbits(present, bitorder='little').view(np.uint64)
+
+
+def unpack_items(words, num_items):
+    return np.flatnonzero(np.unpackbits(words.view(np.uint8), bitorder='little')[:num_items])
+
+
+def cheapest_covering(indptr, indices, costs, items, per_item=CANDIDATES_PER_ITEM):
+    # For every item in items, the per_item cheapest tests covering it.
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    wanted = np.isin(indices, items)
+    rows, columns = rows[wanted], indices[wanted]
+    order = np.lexsort((rows, costs[rows], columns))
+    rows, columns = rows[order], columns[order]
+    starts = np.flatnonzero(np.r_[True, columns[1:] != columns[:-1]])
+    rank = np.arange(len(columns)) - np.repeat(starts, np.diff(np.r_[starts, len(columns)]))
+    keep = rank < per_item
+    candidates = {}
+    for item, row in zip(columns[keep], rows[keep]):
+        candidates.setdefault(int(item), []).append(int(row))
+    return candidates
+
+
+def check_plan(resolved_tests, selected, execution_times, source_dir, per_item=CANDIDATES_PER_ITEM):
+    keys, item_names, indptr, indices, _ = build_coverage(resolved_tests, source_dir, item_function=plan_items)
+    row_of = {key: row for row, key in enumerate(keys)}
+    selected_rows = [row_of[key] for key in selected if key in row_of]
+    num_items = len(item_names)
+
+    suite = pack_items(indices, num_items)
+    plan = np.bitwise_or.reduce(pack_bitsets(indptr, indices, num_items, selected_rows), axis=0) \
+        if selected_rows else np.zeros_like(suite)
+    uncovered = unpack_items(suite & ~plan, num_items)
+
+    costs = np.array([execution_times.get(key, 0) for key in keys], dtype=np.float64)
+    candidates = cheapest_covering(indptr, indices, costs, uncovered, per_item) if uncovered.size else {}
+    return {
+        "items": num_items,
+        "covered": num_items - len(uncovered),
+        "uncovered": [{"item": item_names[item],
+                       "cheapest": [{"test": keys[row], "time": float(costs[row])} for row in candidates.get(int(item), [])]}
+                      for item in uncovered],
+    }
+
+
+def print_check(report):
+    print("Coverage Check: {} of {} items covered".format(report["covered"], report["items"]))
+    for entry in report["uncovered"]:
+        print("Uncovered {}: {}".format(entry["item"], ', '.join(
+            "{} ({} seconds)".format(candidate["test"], int(candidate["time"])) for candidate in entry["cheapest"])))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='check that a reduced plan covers everything the full suite covers')
+    parser.add_argument('--config', required=True)
+    parser.add_argument('plan', help='file with one selected test name per line')
+    args = parser.parse_args()
+    with open(args.config, 'r') as file:
+        resolved_tests = resolve_test_cases(json.load(file))
+    with open(args.plan, 'r') as file:
+        selected = [line.strip() for line in file if line.strip()]
+    execution_times = {key: resolved_tests[key].get('test_timeout', 0) for key in resolved_tests}
+    report = check_plan(resolved_tests, selected, execution_times, os.path.dirname(args.config))
+    print_check(report)
+    raise SystemExit(1 if report["uncovered"] else 0)
@@ -0,0 +1,141 @@
+import heapq
+import os
+
+import numpy as np
+
+from source_index import load_source_index
+
+KIND_WEIGHTS = {"requirement": 4, "hypervisor": 3, "component": 2, "cluster": 2, "tag": 1, "workflow": 1}
+PRIORITY_WEIGHTS = {"$P0": 4, "$P1": 2, "$P2": 1}
+DEFAULT_PRIORITY_WEIGHT = 1
+
+
+def hypervisor_combo(spec):
+    config = spec.get("config", {})
+    params = config.get("params")
+    if not params:
+        return os.path.splitext(config.get("path", ""))[0].split("topology/")[-1]
+    pes = []
+    for pe in range(1, 10):
+        hypervisors = params.get("pe_{}_hypervisors".format(pe))
+        if hypervisors is None:
+            break
+        version = params.get("pe_{}_hypervisor_version".format(pe))
+        pes.append("+".join(hypervisors) + ("-" + version if version else ""))
+    return "{}:{}".format("xi" if params.get("is_xi") else "onprem", "/".join(pes))
+
+
+def coverage_items(resolved, source_entry=None):
+    metadata = dict((source_entry or {}).get("metadata", {}))
+    metadata.update(resolved.get("Metadata") or {})
+    items = set()
+    for kind, field in (("requirement", "Requirements"), ("component", "Components"), ("tag", "Tags")):
+        values = metadata.get(field) or []
+        items.update("{}:{}".format(kind, value) for value in ([values] if isinstance(values, str) else values))
+    items.update("hypervisor:" + hypervisor_combo(spec) for spec in resolved.get("resource_spec", []))
+    items.update("workflow:" + call for call in (source_entry or {}).get("calls", []))
+    items.update("workflow:" + step["name"] for step in resolved.get("pre_run", []) if "name" in step)
+    return items
+
+
+def test_priority(resolved, source_entry=None):
+    metadata = dict((source_entry or {}).get("metadata", {}))
+    metadata.update(resolved.get("Metadata") or {})
+    return metadata.get("Priority")
+
+
+def build_coverage(test_cases, source_dir, clusters=None, item_function=coverage_items):
+    # Coverage as a CSR incidence matrix: row t holds the item ids test t covers.
+    source_index = load_source_index(source_dir, test_cases)
+    cluster_of = {test_case: cluster_id for cluster_id, group in (clusters or {}).items() for test_case in group}
+    keys = list(test_cases.keys())
+    item_ids = {}
+    indptr = [0]
+    indices = []
+    priorities = []
+    for key in keys:
+        items = item_function(test_cases[key], source_index.get(key))
+        if key in cluster_of:
+            items.add("cluster:{}".format(cluster_of[key]))
+        indices.extend(item_ids.setdefault(item, len(item_ids)) for item in sorted(items))
+        indptr.append(len(indices))
+        priorities.append(PRIORITY_WEIGHTS.get(test_priority(test_cases[key], source_index.get(key)),
+                                               DEFAULT_PRIORITY_WEIGHT))
+    item_names = [None] * len(item_ids)
+    for item, item_id in item_ids.items():
+        item_names[item_id] = item
+    indptr = np.asarray(indptr, dtype=np.int64)
+    indices = np.asarray(indices, dtype=np.int64)
+    row_priority = np.repeat(np.asarray(priorities, dtype=np.float64), np.diff(indptr))
+    item_weights = np.zeros(len(item_names), dtype=np.float64)
+    np.maximum.at(item_weights, indices, row_priority)
+    item_weights *= np.array([KIND_WEIGHTS.get(name.split(":", 1)[0], 1) for name in item_names], dtype=np.float64)
+    return keys, item_names, indptr, indices, item_weights
+
+
+def subset_rows(indptr, indices, rows):
+    rows = np.asarray(rows, dtype=np.int64)
+    lengths = indptr[rows + 1] - indptr[rows]
+    sub_indptr = np.concatenate(([0], np.cumsum(lengths)))
+    offsets = np.repeat(indptr[rows] - sub_indptr[:-1], lengths)
+    return sub_indptr, indices[np.arange(sub_indptr[-1]) + offsets]
+
+
+def row_gains(indptr, indices, item_weights):
+    gains = np.zeros(len(indptr) - 1, dtype=np.float64)
+    nonempty = np.diff(indptr) > 0
+    if indices.size:
+        gains[nonempty] = np.add.reduceat(item_weights[indices], indptr[:-1][nonempty])
+    return gains
+
+
+def budgeted_max_coverage(costs, indptr, indices, item_weights, budget, max_test_cost=None):
+    # Lazy greedy on gain/cost: a popped test whose refreshed ratio still beats
+    # the next best upper bound is taken without re-scoring the others.
+    costs = np.maximum(np.asarray(costs, dtype=np.float64), 1.0)
+    affordable = costs <= min(budget, max_test_cost if max_test_cost is not None else budget)
+    gains = row_gains(indptr, indices, item_weights)
+    heap = [(-gains[t] / costs[t], t) for t in np.flatnonzero(affordable & (gains > 0))]
+    heapq.heapify(heap)
+
+    covered = np.zeros(len(item_weights), dtype=bool)
+    selected = []
+    spent = 0.0
+    total_gain = 0.0
+    while heap:
+        _, t = heapq.heappop(heap)
+        if spent + costs[t] > budget:
+            continue
+        items = indices[indptr[t]:indptr[t + 1]]
+        gain = item_weights[items[~covered[items]]].sum()
+        if gain <= 0:
+            continue
+        ratio = gain / costs[t]
+        if heap and ratio < -heap[0][0]:
+            heapq.heappush(heap, (-ratio, t))
+            continue
+        selected.append(int(t))
+        covered[items] = True
+        spent += costs[t]
+        total_gain += gain
+
+    # Greedy by ratio alone can be arbitrarily bad; the best single test bounds it.
+    candidates = np.flatnonzero(affordable)
+    if candidates.size:
+        best = candidates[np.argmax(gains[candidates])]
+        if gains[best] > total_gain:
+            selected = [int(best)]
+            covered[:] = False
+            covered[indices[indptr[best]:indptr[best + 1]]] = True
+    return selected, covered
+
+
+def select_within_budget(test_cases, execution_times, source_dir, budget_hours, testbeds=1, clusters=None):
+    keys, item_names, indptr, indices, item_weights = build_coverage(test_cases, source_dir, clusters)
+    costs = [execution_times[key] for key in keys]
+    wall_budget = budget_hours * 3600
+    selected, covered = budgeted_max_coverage(costs, indptr, indices, item_weights,
+                                              wall_budget * testbeds, max_test_cost=wall_budget)
+    uncovered = [item_names[item] for item in np.flatnonzero(~covered)]
+    coverage = item_weights[covered].sum() / item_weights.sum() if item_weights.sum() else 1.0
+    return [keys[t] for t in selected], coverage, uncovered
@@ -0,0 +1,121 @@
+import itertools
+import os
+
+import numpy as np
+
+from coverage_check import pack_bitsets
+
+# Dimensions a test's variants differ along; a family is every variant of one
+# test method (test_x, test_x___esx, test_x___esx_xi, ...). A value of None is
+# unknown and acts as a wildcard: the variant adds no combination with it.
+DIMENSIONS = ("site", "source", "remote", "version", "ipam")
+HYPERVISOR_NAMES = {"vsphere": "esx", "esx": "esx", "ahv": "ahv"}
+POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.int64)
+
+
+def topology_dimensions(spec):
+    config = spec.get("config", {})
+    params = config.get("params")
+    if not params:
+        # Named topologies only say it in their file name, e.g.
+        # onprem_esx_3pe_2pc: every PE of an esx topology runs ESX, in a
+        # version the name does not give.
+        tokens = os.path.splitext(os.path.basename(config.get("path", "")))[0].split("_")
+        hypervisor = "esx" if "esx" in tokens else "ahv"
+        return {"site": "xi" if "xi" in tokens else "onprem", "source": hypervisor, "remote": hypervisor,
+                "version": None if hypervisor == "esx" else "default"}
+    hypervisors, versions = [], []
+    for pe in range(1, 10):
+        names = params.get("pe_{}_hypervisors".format(pe))
+        if names is None:
+            break
+        hypervisors.append("+".join(HYPERVISOR_NAMES.get(name, name) for name in names))
+        if params.get("pe_{}_hypervisor_version".format(pe)):
+            versions.append(params["pe_{}_hypervisor_version".format(pe)])
+    esx = any("esx" in hypervisor.split("+") for hypervisor in hypervisors)
+    return {"site": "xi" if params.get("is_xi") else "onprem", "source": hypervisors[0] if hypervisors else "ahv",
+            "remote": hypervisors[1] if len(hypervisors) > 1 else "ahv",
+            "version": "/".join(versions) or (None if esx else "default")}
+
+
+def variant_dimensions(resolved, topology=None):
+    # The value of every dimension for one resolved test; the first resource
+    # spec is the topology the test runs on. topology, if given, is its
+    # already computed topology_dimensions.
+    specs = resolved.get("resource_spec") or [{}]
+    values = dict(topology or topology_dimensions(specs[0]))
+    values["ipam"] = "custom" if (resolved.get("test_args") or {}).get("use_default_ipam") is False else "default"
+    return tuple(values[dimension] for dimension in DIMENSIONS)
+
+
+def interaction_rows(values, strength):
+    # CSR rows of the strength-wise (dimension, value) combinations each
+    # variant covers, numbered within the family; combinations with an
+    # unknown value are left out. A variant with fewer known dimensions than
+    # strength covers its whole known tuple, so it still has to be covered
+    # and raising strength never drops it from the plan.
+    combination_ids = {}
+    indptr = [0]
+    indices = []
+    for variant in values:
+        known = [dimension for dimension, value in enumerate(variant) if value is not None]
+        for dimensions in itertools.combinations(known, min(strength, len(known))):
+            indices.append(combination_ids.setdefault(tuple((dimension, variant[dimension])
+                                                            for dimension in dimensions), len(combination_ids)))
+        indptr.append(len(indices))
+    return np.asarray(indptr, dtype=np.int64), np.asarray(indices, dtype=np.int64), len(combination_ids)
+
+
+def popcounts(bits):
+    return POPCOUNT[bits.view(np.uint8)].sum(axis=1)
+
+
+def greedy_covering(bits, costs):
+    # Greedy set cover on newly covered combinations per second, scored for
+    # every variant at once on the packed rows; then the most expensive picks
+    # that the others already cover are dropped again.
+    costs = np.maximum(np.asarray(costs, dtype=np.float64), 1.0)
+    uncovered = np.bitwise_or.reduce(bits, axis=0)
+    selected = []
+    while uncovered.any():
+        gains = popcounts(bits & uncovered)
+        best = int(np.argmax(gains / costs))
+        selected.append(best)
+        uncovered &= ~bits[best]
+    for row in sorted(selected, key=lambda row: -costs[row]):
+        others = [other for other in selected if other != row]
+        if others and not (bits[row] & ~np.bitwise_or.reduce(bits[others], axis=0)).any():
+            selected = others
+    return sorted(selected)
+
+
+def select_covering_array(catalogue, resolved_tests, strength=2):
+    # Per family, the cheapest variants found that together cover every
+    # strength-wise combination of dimension values its variants cover.
+    # Returns the selected test ids, the number of families and of
+    # combinations; class entries, which have no resolved entry, are skipped.
+    strength = max(1, min(strength, len(DIMENSIONS)))
+    ids = np.array([test_id for test_id, name in enumerate(catalogue.names.strings) if name in resolved_tests],
+                   dtype=np.int64)
+    families = catalogue.families(ids)
+    order = np.argsort(families, kind='stable')
+    # Topologies repeat across families, so their dimensions are worked out
+    # once per catalogue topology id.
+    topologies = {}
+    for test_id in ids.tolist():
+        topology = catalogue.topology[test_id]
+        if topology not in topologies:
+            specs = resolved_tests[catalogue.names[test_id]].get("resource_spec") or [{}]
+            topologies[topology] = topology_dimensions(specs[0])
+    selected = []
+    combinations = 0
+    for family in np.split(ids[order], np.flatnonzero(np.diff(families[order])) + 1):
+        if not family.size:
+            continue
+        indptr, indices, num_combinations = interaction_rows(
+            [variant_dimensions(resolved_tests[catalogue.names[test_id]], topologies[catalogue.topology[test_id]])
+             for test_id in family.tolist()], strength)
+        bits = pack_bitsets(indptr, indices, num_combinations)
+        selected.extend(family[greedy_covering(bits, catalogue.cost[family])].tolist())
+        combinations += num_combinations
+    return np.sort(np.asarray(selected, dtype=np.int64)), len(np.unique(families)), combinations
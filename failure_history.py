@@ -0,0 +1,79 @@
+import argparse
+import json
+import os
+
+import numpy as np
+
+RECORD_DTYPE = np.dtype([("test", "<u4"), ("run", "<u4"), ("failed", "u1")])
+DEFAULT_HALF_LIFE = 10
+PRIOR_FAILURES = 1.0
+PRIOR_RUNS = 10.0
+
+
+# A history store is two append-only files: <path>.names holds one test name
+# per line (its line number is the test id) and <path>.bin holds fixed-size
+# (test id, run number, failed) records.
+def load_names(store_path):
+    if not os.path.exists(store_path + ".names"):
+        return []
+    with open(store_path + ".names", 'r') as file:
+        return file.read().splitlines()
+
+
+def load_records(store_path):
+    if not os.path.exists(store_path + ".bin"):
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.fromfile(store_path + ".bin", dtype=RECORD_DTYPE)
+
+
+def record_run(store_path, results):
+    names = load_names(store_path)
+    test_ids = {name: idx for idx, name in enumerate(names)}
+    records = load_records(store_path)
+    run = int(records["run"].max()) + 1 if records.size else 0
+
+    new_names = [test_case for test_case in results if test_case not in test_ids]
+    for test_case in new_names:
+        test_ids[test_case] = len(test_ids)
+    if new_names:
+        with open(store_path + ".names", 'a') as file:
+            file.write("".join(name + "\n" for name in new_names))
+
+    batch = np.zeros(len(results), dtype=RECORD_DTYPE)
+    batch["test"] = [test_ids[test_case] for test_case in results]
+    batch["run"] = run
+    batch["failed"] = [outcome != "PASS" for outcome in results.values()]
+    with open(store_path + ".bin", 'ab') as file:
+        batch.tofile(file)
+    return run
+
+
+def failure_scores(store_path, test_case_keys, half_life=DEFAULT_HALF_LIFE):
+    # Exponentially decayed failure rate per test, smoothed towards
+    # PRIOR_FAILURES / PRIOR_RUNS so that unseen tests are not ranked last.
+    names = load_names(store_path)
+    records = load_records(store_path)
+    prior = PRIOR_FAILURES / PRIOR_RUNS
+    if not records.size:
+        return dict.fromkeys(test_case_keys, prior)
+
+    age = records["run"].max() - records["run"].astype(np.float64)
+    weights = np.power(0.5, age / half_life)
+    failures = np.bincount(records["test"], weights=weights * records["failed"], minlength=len(names))
+    runs = np.bincount(records["test"], weights=weights, minlength=len(names))
+    scores = (failures + PRIOR_FAILURES) / (runs + PRIOR_RUNS)
+
+    test_ids = {name: idx for idx, name in enumerate(names)}
+    lookup = np.array([test_ids.get(test_case, -1) for test_case in test_case_keys], dtype=np.int64)
+    catalogue_scores = np.where(lookup >= 0, scores[np.maximum(lookup, 0)], prior)
+    return dict(zip(test_case_keys, catalogue_scores.tolist()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='append a run of test results to a failure history store')
+    parser.add_argument('store')
+    parser.add_argument('results', help='JSON object mapping test names to PASS/FAIL/ERROR')
+    args = parser.parse_args()
+    with open(args.results, 'r') as file:
+        run = record_run(args.store, json.load(file))
+    print("Recorded run {} in {}".format(run, args.store))
@@ -0,0 +1,99 @@
+import json
+
+import numpy as np
+from scipy import sparse
+
+from config_store import canonical_json
+from numpy_backend import word_tokens
+
+# Fields vectorised separately, each with its own tokens and weight. A weight
+# is the field's share of the combined cosine similarity, so a long
+# expected_fatals list no longer outweighs a topology difference.
+FIELDS = ("resource_spec", "expected_fatals", "Metadata", "test_args")
+DEFAULT_FIELD_WEIGHTS = {"resource_spec": 3.0, "expected_fatals": 0.5, "Metadata": 1.0, "test_args": 1.5}
+
+
+def flatten(value, path=""):
+    if isinstance(value, dict):
+        for key in sorted(value):
+            for token in flatten(value[key], path + "." + key if path else key):
+                yield token
+    elif isinstance(value, list):
+        for item in value:
+            for token in flatten(item, path):
+                yield token
+    elif value is not None and value != "":
+        yield "{}={}".format(path, json.dumps(value) if not isinstance(value, str) else value)
+
+
+def path_tokens(text):
+    # "config.params.pe_1_hypervisors=esx", "Tags=$P0": one token per leaf,
+    # so a value only matches the same value at the same place.
+    return list(flatten(json.loads(text))) if text else []
+
+
+def fatal_tokens(text):
+    # Fatal patterns and log targets are free text; words are what repeat.
+    return word_tokens(text)
+
+
+FIELD_ANALYZERS = {
+    "resource_spec": path_tokens,
+    "expected_fatals": fatal_tokens,
+    "Metadata": path_tokens,
+    "test_args": path_tokens,
+}
+
+
+def field_payload(test_case):
+    # Same text as json.dumps of the four fields with sort_keys, assembled from
+    # the per-node canonical_json cache.
+    return "{" + ", ".join('"{}": {}'.format(field, canonical_json(test_case.get(field)))
+                           for field in sorted(FIELDS)) + "}"
+
+
+def field_texts(payloads):
+    # Splits field_payload strings back into one canonical text per field.
+    texts = {field: [] for field in FIELDS}
+    for payload in payloads:
+        entry = json.loads(payload)
+        for field in FIELDS:
+            value = entry[field]
+            texts[field].append(json.dumps(value, sort_keys=True) if value not in (None, "", [], {}) else "")
+    return texts
+
+
+def parse_field_weights(text):
+    # "resource_spec=3,expected_fatals=0.5"; unnamed fields keep their default.
+    field_weights = dict(DEFAULT_FIELD_WEIGHTS)
+    for part in filter(None, (text or "").split(",")):
+        field, _, weight = part.partition("=")
+        if field not in FIELD_ANALYZERS:
+            raise ValueError("unknown field {}".format(field))
+        try:
+            field_weights[field] = float(weight)
+        except ValueError:
+            raise ValueError("invalid weight {!r} for field {}".format(weight, field))
+    return field_weights
+
+
+class FieldVectors(object):
+    # Unit-norm TF-IDF block per field, kept apart so that reweighting is a
+    # column scaling of the stacked blocks rather than a refit.
+    def __init__(self, blocks):
+        # blocks maps a field to its (vectors, terms) pair.
+        self.blocks = {field: sparse.csr_matrix(block[0]) for field, block in blocks.items()}
+        self.block_terms = {field: block[1] for field, block in blocks.items()}
+
+    def terms(self):
+        # Column names of combine(), prefixed with their field.
+        return ["{}:{}".format(field, term) for field in FIELDS if field in self.blocks
+                for term in self.block_terms[field]]
+
+    def combine(self, field_weights=None):
+        field_weights = field_weights or DEFAULT_FIELD_WEIGHTS
+        stacked = sparse.hstack([self.blocks[field] * np.sqrt(field_weights.get(field, 0.0))
+                                 for field in FIELDS if field in self.blocks], format='csr')
+        norms = np.sqrt(np.asarray(stacked.multiply(stacked).sum(axis=1)).ravel())
+        norms[norms == 0] = 1.0
+        return sparse.csr_matrix(sparse.diags(1.0 / norms) @ stacked)
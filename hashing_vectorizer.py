@@ -0,0 +1,217 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from scipy import sparse
+
+from numpy_backend import word_tokens
+
+DEFAULT_FEATURES = 2 ** 20
+# Below this many texts a process pool costs more than it saves.
+PARALLEL_MIN_TEXTS = 5000
+CHUNKS_PER_WORKER = 4
+
+
+def token_hashes(tokens):
+    digests = b"".join(hashlib.blake2b(token.encode(), digest_size=8).digest() for token in tokens)
+    return np.frombuffer(digests, dtype=np.uint64)
+
+
+def hashed_counts(text, n_features, analyzer=word_tokens):
+    # Signed feature hashing: a token adds +-1 to its column, so two tokens
+    # colliding in one column cancel out on average instead of adding up.
+    hashes = token_hashes(analyzer(text))
+    columns, inverse = np.unique((hashes % np.uint64(n_features)).astype(np.int64), return_inverse=True)
+    signs = np.where(hashes >> np.uint64(63), 1.0, -1.0)
+    return columns, np.bincount(inverse.ravel(), weights=signs, minlength=len(columns))
+
+
+def shared_array(block, dtype, size):
+    # frombuffer holds a buffer export, so the block cannot be unmapped while
+    # the array or any view of it is alive.
+    return np.frombuffer(block.buf, dtype=dtype, count=size)
+
+
+def hash_chunk(texts, n_features, names, capacity, first_row, offset):
+    # Worker side of hashed_rows: writes the chunk's columns and counts
+    # contiguously from offset in the shared buffers and each row's length at
+    # first_row onwards, and returns how many entries it wrote.
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    indices, data, lengths = (shared_array(block, dtype, size) for block, dtype, size in
+                              zip(blocks, (np.int32, np.float64, np.int64), capacity))
+    position = offset
+    for row, text in enumerate(texts, first_row):
+        columns, counts = hashed_counts(text, n_features)
+        indices[position:position + len(columns)] = columns
+        data[position:position + len(columns)] = counts
+        lengths[row] = len(columns)
+        position += len(columns)
+    del indices, data, lengths
+    for block in blocks:
+        block.close()
+    return position - offset
+
+
+def hashed_rows(texts, n_features=DEFAULT_FEATURES, analyzer=word_tokens, workers=1):
+    # Signed hashed counts of each text as CSR. Large inputs are split into
+    # chunks hashed by a process pool straight into shared memory: every chunk
+    # owns a slice of the indices and data buffers sized by an upper bound on
+    # its entries (a \w\w+ token spans at least two characters), the slices
+    # are then packed together in place and the matrix is built on the shared
+    # buffers, so no array is pickled or copied into the parent.
+    if workers <= 1 or len(texts) < PARALLEL_MIN_TEXTS or analyzer is not word_tokens:
+        rows = [hashed_counts(text, n_features, analyzer) for text in texts]
+        indptr = np.cumsum([0] + [len(columns) for columns, _ in rows])
+        return sparse.csr_matrix((np.concatenate([counts for _, counts in rows]) if rows else np.zeros(0),
+                                  np.concatenate([columns for columns, _ in rows]) if rows else np.zeros(0, np.int64),
+                                  indptr), shape=(len(texts), n_features))
+
+    bounds = np.fromiter((len(text) // 2 + 1 for text in texts), dtype=np.int64, count=len(texts))
+    starts = np.linspace(0, len(texts), workers * CHUNKS_PER_WORKER + 1).astype(np.int64)
+    offsets = np.concatenate([[0], np.cumsum(bounds)])[starts]
+    capacity = (int(offsets[-1]), int(offsets[-1]), len(texts))
+    blocks = [shared_memory.SharedMemory(create=True, size=max(size * np.dtype(dtype).itemsize, 1))
+              for dtype, size in zip((np.int32, np.float64, np.int64), capacity)]
+    try:
+        names = [block.name for block in blocks]
+        with ProcessPoolExecutor(workers) as pool:
+            written = list(pool.map(hash_chunk, *zip(*[
+                (texts[start:end], n_features, names, capacity, start, offset)
+                for start, end, offset in zip(starts[:-1].tolist(), starts[1:].tolist(), offsets[:-1].tolist())])))
+    finally:
+        for block in blocks:
+            block.unlink()
+    indices, data, lengths = (shared_array(block, dtype, size)
+                              for block, dtype, size in zip(blocks, (np.int32, np.float64, np.int64), capacity))
+    position = 0
+    for offset, count in zip(offsets[:-1].tolist(), written):
+        indices[position:position + count] = indices[offset:offset + count]
+        data[position:position + count] = data[offset:offset + count]
+        position += count
+    # The constructor would copy views this much smaller than their buffers,
+    # so the arrays are attached to an empty matrix instead.
+    matrix = sparse.csr_matrix((len(texts), n_features))
+    matrix.indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32 if position < 2 ** 31 else np.int64)
+    matrix.indices = indices[:position].astype(matrix.indptr.dtype, copy=False)
+    matrix.data = data[:position]
+    # The buffers are already unlinked; the mapping lives as long as the matrix.
+    matrix.shared_blocks = blocks
+    return matrix
+
+
+def smoothed_idf(counts, n_documents):
+    # sklearn's smoothed idf.
+    return np.log((1.0 + n_documents) / (1.0 + counts)) + 1.0
+
+
+def weight_rows(vectors, idf):
+    # TF-IDF weighting and l2 normalisation of hashed counts, in place.
+    vectors.data *= idf[vectors.indices]
+    rows = np.repeat(np.arange(vectors.shape[0]), np.diff(vectors.indptr))
+    norms = np.sqrt(np.bincount(rows, weights=vectors.data ** 2, minlength=vectors.shape[0]))
+    norms[norms == 0] = 1.0
+    vectors.data /= norms[rows]
+    return vectors
+
+
+def content_digest(text):
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+
+class DocumentFrequencies(object):
+    # Feature-hashed TF-IDF whose document frequencies are kept per test, so
+    # adding, changing or removing a test only touches that test's columns and
+    # no refit over the whole catalogue is needed. Vectors of any text can be
+    # computed on their own against the current global statistics.
+    def __init__(self, n_features=DEFAULT_FEATURES, analyzer=word_tokens):
+        self.n_features = n_features
+        self.analyzer = analyzer
+        self.counts = np.zeros(n_features, dtype=np.int64)
+        # test name -> (content digest, sorted distinct columns)
+        self.entries = {}
+        self.idf_cache = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, name, text):
+        digest = content_digest(text)
+        entry = self.entries.get(name)
+        if entry is not None and entry[0] == digest:
+            return False
+        self.replace(name, digest, hashed_counts(text, self.n_features, self.analyzer)[0])
+        return True
+
+    def replace(self, name, digest, columns):
+        self.remove(name)
+        self.counts[columns] += 1
+        self.entries[name] = (digest, columns)
+        self.idf_cache = None
+
+    def remove(self, name):
+        entry = self.entries.pop(name, None)
+        if entry is None:
+            return False
+        self.counts[entry[1]] -= 1
+        self.idf_cache = None
+        return True
+
+    def sync(self, texts, workers=1):
+        # Brings the statistics in line with {test name: text}; only tests
+        # whose text changed are tokenised. Returns (added or changed, removed).
+        removed = [name for name in self.entries if name not in texts]
+        for name in removed:
+            self.remove(name)
+        digests = {name: content_digest(text) for name, text in texts.items()}
+        changed = [name for name, digest in digests.items() if self.entries.get(name, (None,))[0] != digest]
+        rows = hashed_rows([texts[name] for name in changed], self.n_features, self.analyzer, workers)
+        # Copied once, so the entries do not pin the shared buffers.
+        for name, columns in zip(changed, np.split(rows.indices.astype(np.int64), rows.indptr[1:-1])):
+            self.replace(name, digests[name], columns)
+        return changed, removed
+
+    def idf(self):
+        # Over every tracked test, recomputed only after the statistics change.
+        if self.idf_cache is None:
+            self.idf_cache = smoothed_idf(self.counts, len(self.entries))
+        return self.idf_cache
+
+    def transform(self, texts, workers=1):
+        # Unit-norm hashed TF-IDF rows, one per text, with n_features columns.
+        return weight_rows(hashed_rows(texts, self.n_features, self.analyzer, workers), self.idf())
+
+    def save(self, path):
+        names = list(self.entries)
+        columns = [self.entries[name][1] for name in names]
+        with open(path + ".tmp", 'wb') as file:
+            np.savez(file, n_features=self.n_features, names=np.array(names, dtype=str),
+                     # Raw bytes: an "S" array would strip trailing NUL bytes.
+                     digests=np.frombuffer(b"".join(self.entries[name][0] for name in names),
+                                           dtype=np.uint8).reshape(len(names), 16),
+                     indptr=np.cumsum([0] + [len(column) for column in columns]),
+                     indices=np.concatenate(columns) if columns else np.zeros(0, dtype=np.int64))
+        os.replace(path + ".tmp", path)
+
+
+def load_document_frequencies(path, n_features=DEFAULT_FEATURES):
+    # A store hashed into a different number of features is started afresh.
+    frequencies = DocumentFrequencies(n_features)
+    if not path or not os.path.exists(path):
+        return frequencies
+    with np.load(path) as saved:
+        if int(saved["n_features"]) != n_features:
+            return frequencies
+        indptr, indices = saved["indptr"], saved["indices"]
+        for row, (name, digest) in enumerate(zip(saved["names"].tolist(), saved["digests"])):
+            frequencies.entries[name] = (digest.tobytes(), indices[indptr[row]:indptr[row + 1]])
+        frequencies.counts = np.bincount(indices, minlength=n_features).astype(np.int64)
+    return frequencies
+
+
+def compact_columns(vectors):
+    # Drops the columns no row uses and names the rest "#<column>", so that
+    # dense conversions and projections only see the used part of the space.
+    used = np.unique(vectors.indices)
+    return vectors[:, used], ["#{}".format(column) for column in used.tolist()]
@@ -0,0 +1,144 @@
+import re
+from collections import Counter
+
+import numpy as np
+
+# Minimal NumPy stand-ins for the scikit-learn pieces test_optimization.py
+# uses. They follow sklearn's defaults (token pattern, smoothed idf, l2 norm,
+# k-means++ init) so small suites cluster the same way without paying for the
+# sklearn import.
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+
+def word_tokens(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class TfidfVectorizer(object):
+    # analyzer, like sklearn's callable analyzer, maps a text to its tokens.
+    def __init__(self, analyzer=None):
+        self.analyzer = analyzer or word_tokens
+        self.vocabulary_ = {}
+        self.idf_ = np.zeros(0)
+
+    def term_counts(self, texts):
+        counts = np.zeros((len(texts), len(self.vocabulary_)), dtype=np.float64)
+        for row, text in enumerate(texts):
+            for term, count in Counter(self.analyzer(text)).items():
+                column = self.vocabulary_.get(term)
+                if column is not None:
+                    counts[row, column] = count
+        return counts
+
+    def fit(self, texts, sample_weight=None):
+        # sample_weight counts a text as that many identical documents.
+        terms = sorted({term for text in texts for term in self.analyzer(text)})
+        self.vocabulary_ = {term: column for column, term in enumerate(terms)}
+        if sample_weight is None:
+            sample_weight = np.ones(len(texts))
+        document_frequency = np.asarray(sample_weight, dtype=np.float64) @ (self.term_counts(texts) > 0)
+        self.idf_ = np.log((1.0 + np.sum(sample_weight)) / (1.0 + document_frequency)) + 1.0
+        return self
+
+    def transform(self, texts):
+        return l2_normalize(self.term_counts(texts) * self.idf_)
+
+    def fit_transform(self, texts, sample_weight=None):
+        return self.fit(texts, sample_weight).transform(texts)
+
+    def get_feature_names_out(self):
+        return np.array(sorted(self.vocabulary_, key=self.vocabulary_.get), dtype=object)
+
+
+def l2_normalize(vectors):
+    norms = np.sqrt(np.einsum("ij,ij->i", vectors, vectors))
+    norms[norms == 0] = 1.0
+    return vectors / norms[:, np.newaxis]
+
+
+def cosine_similarity(vectors):
+    normalized = l2_normalize(np.asarray(vectors, dtype=np.float64))
+    return normalized @ normalized.T
+
+
+def squared_distances(vectors, centers, vector_norms=None):
+    if vector_norms is None:
+        vector_norms = np.einsum("ij,ij->i", vectors, vectors)
+    distances = vector_norms[:, np.newaxis] - 2.0 * vectors @ centers.T + np.einsum("ij,ij->i", centers, centers)
+    return np.maximum(distances, 0.0)
+
+
+def kmeans_plusplus(vectors, n_clusters, random_state, vector_norms, sample_weight):
+    n_samples = vectors.shape[0]
+    n_trials = 2 + int(np.log(n_clusters))
+    centers = np.empty((n_clusters, vectors.shape[1]), dtype=vectors.dtype)
+    centers[0] = vectors[random_state.choice(n_samples, p=sample_weight / sample_weight.sum())]
+    closest = squared_distances(vectors, centers[:1], vector_norms)[:, 0]
+    for center in range(1, n_clusters):
+        total = (closest * sample_weight).sum()
+        if total <= 0:
+            centers[center:] = vectors[random_state.choice(n_samples, n_clusters - center)]
+            break
+        candidates = np.searchsorted(np.cumsum(closest * sample_weight), random_state.uniform(size=n_trials) * total)
+        candidates = np.minimum(candidates, n_samples - 1)
+        candidate_closest = np.minimum(closest, squared_distances(vectors, vectors[candidates], vector_norms).T)
+        best = np.argmin(candidate_closest @ sample_weight)
+        centers[center] = vectors[candidates[best]]
+        closest = candidate_closest[best]
+    return centers
+
+
+class KMeans(object):
+    # One k-means++ start, like sklearn's n_init="auto" since 1.4.
+    def __init__(self, n_clusters=8, random_state=None, max_iter=300, tol=1e-4, n_init=1):
+        self.n_clusters = n_clusters
+        self.random_state = random_state
+        self.max_iter = max_iter
+        self.tol = tol
+        self.n_init = n_init
+
+    def fit(self, vectors, sample_weight=None):
+        vectors = np.asarray(vectors, dtype=np.float64)
+        n_samples = vectors.shape[0]
+        if n_samples < self.n_clusters:
+            raise ValueError("n_samples={} should be >= n_clusters={}.".format(n_samples, self.n_clusters))
+        random_state = np.random.RandomState(self.random_state)
+        sample_weight = np.ones(n_samples) if sample_weight is None else np.asarray(sample_weight, dtype=np.float64)
+        vector_norms = np.einsum("ij,ij->i", vectors, vectors)
+        tolerance = self.tol * np.mean(np.var(vectors, axis=0))
+        best = None
+        for _ in range(self.n_init):
+            labels, centers, inertia = self.lloyd(vectors, vector_norms, sample_weight, tolerance, random_state)
+            if best is None or inertia < best[2]:
+                best = (labels, centers, inertia)
+        self.labels_, self.cluster_centers_, self.inertia_ = best
+        return self
+
+    def lloyd(self, vectors, vector_norms, sample_weight, tolerance, random_state):
+        n_samples = vectors.shape[0]
+        centers = kmeans_plusplus(vectors, self.n_clusters, random_state, vector_norms, sample_weight)
+
+        for _ in range(self.max_iter):
+            distances = squared_distances(vectors, centers, vector_norms)
+            labels = np.argmin(distances, axis=1)
+            counts = np.bincount(labels, weights=sample_weight, minlength=self.n_clusters)
+            # Weighted member sums as one product with the weighted one-hot
+            # membership matrix.
+            membership = np.zeros((self.n_clusters, n_samples))
+            membership[labels, np.arange(n_samples)] = sample_weight
+            new_centers = membership @ vectors
+            empty = counts == 0
+            if empty.any():
+                # Reseed empty clusters with the points furthest from their centre.
+                furthest = np.argsort(-distances[np.arange(n_samples), labels])[:empty.sum()]
+                new_centers[empty] = vectors[furthest]
+                counts[empty] = 1
+            new_centers /= counts[:, np.newaxis]
+            shift = np.sum((new_centers - centers) ** 2)
+            centers = new_centers
+            if shift <= tolerance:
+                break
+
+        distances = squared_distances(vectors, centers, vector_norms)
+        labels = np.argmin(distances, axis=1)
+        return labels, centers, float(distances[np.arange(n_samples), labels] @ sample_weight)
@@ -0,0 +1,163 @@
+import argparse
+import json
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from catalogue import Catalogue
+from config_resolver import resolve_test_cases
+from coverage_selection import budgeted_max_coverage, build_coverage, subset_rows
+from representatives import choose_representatives
+from test_optimization import cosine_similarity, extract_test_cases, fit_unique_vectors, kmeans_fit, load_config
+
+
+class OptimizerState(object):
+    # Everything a query needs, fitted once per config version and swapped
+    # atomically on reload so in-flight requests keep a consistent view.
+    def __init__(self, config_path, num_clusters):
+        self.config_path = config_path
+        self.mtime = os.path.getmtime(config_path)
+        config = load_config(config_path)
+        test_cases = extract_test_cases(config)
+        resolved_tests = resolve_test_cases(config)
+        self.catalogue = Catalogue(test_cases, resolved_tests)
+        # Clustered as test_optimization.py does by default, so plans agree:
+        # similarity rows of the unique payloads, weighted k-means.
+        vectors, weights, self.inverse, _ = fit_unique_vectors(test_cases)
+        self.similarity = cosine_similarity(vectors)
+        self.labels = kmeans_fit(self.similarity * np.sqrt(weights), num_clusters, weights, self.inverse)
+        self.clusters = self.catalogue.groups(self.labels)
+
+        (self.coverage_keys, self.item_names, self.indptr, self.indices,
+         self.item_weights) = build_coverage(resolved_tests, os.path.dirname(config_path), self.clusters)
+        self.costs = np.array([resolved_tests[key].get('test_timeout', 0) for key in self.coverage_keys],
+                              dtype=np.float64)
+
+    def plan(self, suite=None, budget_hours=None, testbeds=1):
+        if budget_hours is None:
+            catalogue = self.catalogue
+            rows = np.array([test_id for test_id, key in enumerate(catalogue.names.strings) if in_suite(key, suite)],
+                            dtype=np.int64)
+            selected = rows[choose_representatives(self.labels[rows], catalogue.cost[rows],
+                                                   runnable=catalogue.runnable[rows])]
+            return {"selected": catalogue.names_of(np.sort(selected)),
+                    "optimized_time": float(catalogue.cost[selected].sum()),
+                    "normal_time": float(catalogue.cost[rows].sum())}
+
+        rows = [idx for idx, key in enumerate(self.coverage_keys) if in_suite(key, suite)]
+        indptr, indices = subset_rows(self.indptr, self.indices, rows)
+        wall_budget = budget_hours * 3600
+        selected, covered = budgeted_max_coverage(self.costs[rows], indptr, indices, self.item_weights,
+                                                  wall_budget * testbeds, max_test_cost=wall_budget)
+        reachable = np.zeros(len(self.item_weights), dtype=bool)
+        reachable[indices] = True
+        total = self.item_weights[reachable].sum()
+        return {"selected": [self.coverage_keys[rows[t]] for t in selected],
+                "optimized_time": float(self.costs[rows][selected].sum()),
+                "normal_time": float(self.costs[rows].sum()),
+                "coverage": float(self.item_weights[covered].sum() / total) if total else 1.0,
+                "uncovered": [self.item_names[item] for item in np.flatnonzero(reachable & ~covered)]}
+
+    def neighbours(self, test_case, count=5):
+        # Similarity rows are per unique payload; inverse spreads them to tests.
+        test_id = self.catalogue.names.ids[test_case]
+        row = np.asarray(self.similarity[self.inverse[test_id]]).ravel()[self.inverse]
+        order = [idx for idx in np.argsort(-row, kind='stable') if idx != test_id][:count]
+        return [{"test": self.catalogue.names[idx], "similarity": float(row[idx])} for idx in order]
+
+
+def in_suite(test_case, suite):
+    return not suite or test_case == suite or test_case.startswith(suite + ".") or ("." + suite + ".") in test_case
+
+
+class OptimizerDaemon(object):
+    def __init__(self, config_path, num_clusters=8, poll_interval=1.0):
+        self.config_path = config_path
+        self.num_clusters = num_clusters
+        self.poll_interval = poll_interval
+        self.state = OptimizerState(config_path, num_clusters)
+        self.stopped = threading.Event()
+
+    def watch(self):
+        while not self.stopped.wait(self.poll_interval):
+            try:
+                if os.path.getmtime(self.config_path) != self.state.mtime:
+                    self.state = OptimizerState(self.config_path, self.num_clusters)
+                    print("Reloaded {}".format(self.config_path))
+            except (OSError, ValueError) as error:
+                print("Reload of {} failed: {}".format(self.config_path, error))
+
+    def handle(self, path, query):
+        state = self.state
+        if path == "/plan":
+            budget = query.get("budget_hours")
+            return state.plan(query.get("suite"), float(budget) if budget else None, int(query.get("testbeds", 1)))
+        if path == "/neighbours":
+            return {"neighbours": state.neighbours(query["test"], int(query.get("count", 5)))}
+        if path == "/clusters":
+            return {"clusters": {str(cluster_id): group for cluster_id, group in state.clusters.items()}}
+        raise LookupError(path)
+
+
+def make_handler(daemon):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            started = time.perf_counter()
+            try:
+                status, body = 200, daemon.handle(url.path, query)
+            except LookupError as error:
+                status, body = 404, {"error": "unknown {}".format(error)}
+            except ValueError as error:
+                status, body = 400, {"error": str(error)}
+            body["elapsed_ms"] = (time.perf_counter() - started) * 1000
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def address_string(self):
+            return self.client_address[0] if self.client_address else "unix"
+
+        def log_message(self, format, *args):
+            pass
+    return Handler
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(config_path, num_clusters=8, port=8642, socket_path=None):
+    daemon = OptimizerDaemon(config_path, num_clusters)
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = UnixHTTPServer(socket_path, make_handler(daemon))
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(daemon))
+    threading.Thread(target=daemon.watch, daemon=True).start()
+    print("Serving {} on {}".format(config_path, socket_path or "http://127.0.0.1:{}".format(port)))
+    try:
+        server.serve_forever()
+    finally:
+        daemon.stopped.set()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', required=True)
+    parser.add_argument('--clusters', type=int, default=8)
+    parser.add_argument('--port', type=int, default=8642)
+    parser.add_argument('--socket', help='serve on this Unix socket instead of localhost TCP')
+    args = parser.parse_args()
+    serve(args.config, args.clusters, args.port, args.socket)
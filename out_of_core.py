@@ -0,0 +1,466 @@
+import argparse
+import codecs
+import itertools
+import json
+import os
+import re
+
+import numpy as np
+from scipy import sparse
+
+import profiling
+from profiling import span
+from config_resolver import base_method_key, class_key, is_test_key
+from cost_aggregation import group_costs
+from hashing_vectorizer import DEFAULT_FEATURES, compact_columns, hashed_rows, smoothed_idf, weight_rows
+from numpy_backend import kmeans_plusplus, squared_distances
+from projection import Projection
+from test_optimization import combine_attributes
+
+# Out-of-core clustering for inventories too large to hold in memory. Every
+# stage streams fixed-size chunks from and to the work directory:
+#   parse      stream test_config members, write names, texts and timeouts
+#   costs      resolve timeouts through the global, class and base-method layers
+#   frequency  hash texts, write raw counts, accumulate document frequencies
+#   vectors    TF-IDF weight and randomly project each chunk to a few dims
+#   kmeans     mini-batch k-means epochs over the chunk vectors
+#   labels     nearest-centroid search for every test
+#   select     longest test and costs per cluster, folded over chunks
+# Memory is bounded by one chunk plus the centroids and the hashed document
+# frequencies. Each (stage, chunk) unit is recorded in manifest.json after its
+# outputs are written, so an interrupted run resumes after the last completed
+# unit.
+DEFAULT_CHUNK_SIZE = 50000
+DEFAULT_DIMS = 64
+DEFAULT_EPOCHS = 3
+READ_SIZE = 1 << 20
+# Rows x centroids per block of the nearest-centroid search.
+DISTANCE_BLOCK = 1 << 22
+WHITESPACE = re.compile(r"\s*")
+# Part of the checkpoint settings: a work directory from another layout of the
+# chunk files is started over.
+CHECKPOINT_FORMAT = 2
+
+
+class JsonStream(object):
+    # Reads JSON values one at a time from a UTF-8 file, keeping only the
+    # unread part of the last read in memory. offset() is the byte position of
+    # the next unread character, from which a later stream can resume.
+    def __init__(self, file, offset=0):
+        file.seek(offset)
+        self.file = file
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.base = offset
+        self.eof = False
+
+    def fill(self):
+        self.base += len(self.buffer[:self.pos].encode())
+        data = self.file.read(READ_SIZE)
+        self.eof = not data
+        self.buffer = self.buffer[self.pos:] + self.text_decoder.decode(data, final=self.eof)
+        self.pos = 0
+
+    def offset(self):
+        return self.base + len(self.buffer[:self.pos].encode())
+
+    def peek(self):
+        # The next non-whitespace character, "" at the end of the file.
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self.fill()
+
+    def expect(self, characters):
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError("expected one of {!r} at byte {}".format(characters, self.offset()))
+        self.pos += 1
+        return character
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+                # A number running into the end of the buffer may continue.
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+def test_config_entries(stream, resume=False, others=None):
+    # Yields the (key, entry) members of the top-level "test_config" object;
+    # other top-level values are skipped, or stored in others when given. With
+    # resume, the stream is positioned just after a member.
+    if not resume:
+        stream.expect("{")
+        if stream.peek() == "}":
+            return
+        while True:
+            key = stream.value()
+            stream.expect(":")
+            if key == "test_config":
+                break
+            value = stream.value()
+            if others is not None:
+                others[key] = value
+            if stream.expect(",}") == "}":
+                return
+        stream.expect("{")
+        more = stream.peek() != "}"
+        if not more:
+            stream.expect("}")
+    else:
+        more = stream.expect(",}") == ","
+    while more:
+        key = stream.value()
+        stream.expect(":")
+        yield key, stream.value()
+        more = stream.expect(",}") == ","
+    # Top-level members after test_config.
+    while stream.expect(",}") == ",":
+        key = stream.value()
+        stream.expect(":")
+        value = stream.value()
+        if others is not None:
+            others[key] = value
+
+
+def save_arrays(path, **arrays):
+    with open(path + ".tmp", 'wb') as file:
+        np.savez(file, **arrays)
+    os.replace(path + ".tmp", path)
+
+
+def load_arrays(path):
+    with np.load(path) as saved:
+        return {name: saved[name] for name in saved.files}
+
+
+def save_lines(path, lines):
+    with open(path + ".tmp", 'w') as file:
+        file.write("".join(line + "\n" for line in lines))
+    os.replace(path + ".tmp", path)
+
+
+def load_lines(path):
+    with open(path, 'r') as file:
+        return file.read().splitlines()
+
+
+class Checkpoint(object):
+    # manifest.json records the run settings and the completed units with
+    # their results. A manifest written with other settings is ignored, and
+    # the run starts over.
+    def __init__(self, workdir, settings):
+        os.makedirs(workdir, exist_ok=True)
+        self.workdir = workdir
+        self.settings = settings
+        self.manifest_path = os.path.join(workdir, "manifest.json")
+        manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as file:
+                manifest = json.load(file)
+        self.resumed = manifest.get("settings") == settings and bool(manifest.get("units"))
+        self.units = manifest.get("units", {}) if manifest.get("settings") == settings else {}
+
+    def path(self, name):
+        return os.path.join(self.workdir, name)
+
+    def chunk_path(self, chunk, kind):
+        return self.path("chunk_{:05d}.{}".format(chunk, kind))
+
+    def done(self, unit):
+        return unit in self.units
+
+    def complete(self, unit, result=None):
+        self.units[unit] = result
+        with open(self.manifest_path + ".tmp", 'w') as file:
+            json.dump({"settings": self.settings, "units": self.units}, file)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
+
+
+def map_chunks(checkpoint, stage, num_chunks, function):
+    # function(chunk) writes the chunk's outputs; chunks already done are skipped.
+    with span(stage) as progress:
+        for chunk in range(num_chunks):
+            unit = "{}:{}".format(stage, chunk)
+            if not checkpoint.done(unit):
+                function(chunk)
+                checkpoint.complete(unit)
+                progress.count(1)
+
+
+def fold_chunks(checkpoint, stage, num_chunks, state, step):
+    # Threads a dict of arrays through step(state, chunk) over the chunks. The
+    # state after each chunk is saved (replacing the previous one), so a
+    # resumed fold continues from the last completed chunk.
+    def state_path(chunk):
+        return checkpoint.path("{}_{:05d}.npz".format(stage, chunk))
+
+    start = 0
+    while start < num_chunks and checkpoint.done("{}:{}".format(stage, start)):
+        start += 1
+    if start:
+        state = load_arrays(state_path(start - 1))
+    with span(stage) as progress:
+        for chunk in range(start, num_chunks):
+            state = step(state, chunk)
+            save_arrays(state_path(chunk), **state)
+            checkpoint.complete("{}:{}".format(stage, chunk))
+            if chunk and os.path.exists(state_path(chunk - 1)):
+                os.remove(state_path(chunk - 1))
+            progress.count(1)
+    return state
+
+
+def layer_timeout(key, entry):
+    # Class entries and base methods are layers other entries inherit their
+    # timeout from; only the ones that set it are kept.
+    if "test_timeout" in entry and (not is_test_key(key) or base_method_key(key) == key):
+        return entry["test_timeout"]
+    return None
+
+
+def parse_stage(checkpoint, config_path, chunk_size):
+    # Returns the number of tests in each chunk. A chunk's offset is where
+    # parsing resumes after it; a short chunk ends test_config and has none.
+    # Each chunk keeps its own timeouts (NaN when unset) and its layer
+    # timeouts; the global timeout is recorded once global_config is read.
+    if checkpoint.done("parse"):
+        return checkpoint.units["parse"]
+    sizes = []
+    offset = 0
+    while checkpoint.done("parse:{}".format(len(sizes))):
+        result = checkpoint.units["parse:{}".format(len(sizes))]
+        sizes.append(result["tests"])
+        offset = result["offset"]
+    others = {}
+
+    def record_global():
+        if "global_config" in others and not checkpoint.done("global_config"):
+            checkpoint.complete("global_config", {"test_timeout": others["global_config"].get("test_timeout")})
+
+    with open(config_path, 'rb') as file, span("parse") as progress:
+        stream = JsonStream(file, offset or 0)
+        entries = test_config_entries(stream, bool(sizes), others) if offset is not None else iter(())
+        while True:
+            batch = list(itertools.islice(entries, chunk_size))
+            record_global()
+            if not batch:
+                break
+            chunk = len(sizes)
+            save_lines(checkpoint.chunk_path(chunk, "names"), [key for key, _ in batch])
+            save_lines(checkpoint.chunk_path(chunk, "texts"), [combine_attributes(entry) for _, entry in batch])
+            save_arrays(checkpoint.chunk_path(chunk, "timeouts.npz"),
+                        timeouts=np.array([entry.get('test_timeout', np.nan) for _, entry in batch], dtype=np.float64))
+            layers = {key: timeout for key, timeout in ((key, layer_timeout(key, entry)) for key, entry in batch)
+                      if timeout is not None}
+            save_lines(checkpoint.chunk_path(chunk, "layers.json"), [json.dumps(layers)])
+            finished = len(batch) < chunk_size
+            checkpoint.complete("parse:{}".format(chunk),
+                                {"tests": len(batch), "offset": None if finished else stream.offset()})
+            sizes.append(len(batch))
+            progress.count(len(batch))
+            if finished:
+                # Reads the top-level members after test_config.
+                for _ in entries:
+                    pass
+                record_global()
+                break
+    checkpoint.complete("parse", sizes)
+    return sizes
+
+
+def costs_function(checkpoint, num_chunks):
+    # A test's cost is the first timeout set on it, its base method, its class
+    # or global_config, as resolve_test_case merges them; class entries are
+    # layers rather than tests and cost nothing.
+    layers = {}
+    for chunk in range(num_chunks):
+        layers.update(json.loads(load_lines(checkpoint.chunk_path(chunk, "layers.json"))[0]))
+    default = (checkpoint.units.get("global_config") or {}).get("test_timeout")
+
+    def function(chunk):
+        timeouts = load_arrays(checkpoint.chunk_path(chunk, "timeouts.npz"))["timeouts"]
+        costs = np.zeros(len(timeouts))
+        for row, key in enumerate(load_lines(checkpoint.chunk_path(chunk, "names"))):
+            if not is_test_key(key):
+                continue
+            candidates = (timeouts[row] if not np.isnan(timeouts[row]) else None,
+                          layers.get(base_method_key(key)), layers.get(class_key(key)), default)
+            costs[row] = next((timeout for timeout in candidates if timeout is not None), 0)
+        save_arrays(checkpoint.chunk_path(chunk, "costs.npz"), costs=costs)
+    return function
+
+
+def frequency_step(checkpoint, n_features, workers):
+    def step(state, chunk):
+        rows = hashed_rows(load_lines(checkpoint.chunk_path(chunk, "texts")), n_features, workers=workers)
+        save_arrays(checkpoint.chunk_path(chunk, "counts.npz"), data=rows.data, indices=rows.indices,
+                    indptr=rows.indptr)
+        return {"counts": state["counts"] + np.bincount(rows.indices, minlength=n_features),
+                "documents": state["documents"] + rows.shape[0]}
+    return step
+
+
+def vectors_function(checkpoint, n_features, idf, projection):
+    def function(chunk):
+        saved = load_arrays(checkpoint.chunk_path(chunk, "counts.npz"))
+        rows = sparse.csr_matrix((saved["data"], saved["indices"], saved["indptr"]),
+                                 shape=(len(saved["indptr"]) - 1, n_features))
+        vectors, terms = compact_columns(weight_rows(rows, idf))
+        save_arrays(checkpoint.chunk_path(chunk, "vectors.npz"),
+                    vectors=projection.transform(vectors, terms).astype(np.float32))
+    return function
+
+
+def load_vectors(checkpoint, chunk):
+    return load_arrays(checkpoint.chunk_path(chunk, "vectors.npz"))["vectors"].astype(np.float64)
+
+
+def initial_centers(checkpoint, num_chunks, num_clusters, seed):
+    # k-means++ over the first chunks, at least twice as many rows as clusters.
+    sample = []
+    for chunk in range(num_chunks):
+        sample.append(load_vectors(checkpoint, chunk))
+        if sum(len(vectors) for vectors in sample) >= 2 * num_clusters:
+            break
+    sample = np.concatenate(sample)
+    return kmeans_plusplus(sample, num_clusters, np.random.RandomState(seed),
+                           np.einsum("ij,ij->i", sample, sample), np.ones(len(sample)))
+
+
+def nearest_centers(vectors, centers):
+    rows = max(1, DISTANCE_BLOCK // len(centers))
+    return np.concatenate([np.argmin(squared_distances(vectors[start:start + rows], centers), axis=1)
+                           for start in range(0, len(vectors), rows)])
+
+
+def kmeans_step(checkpoint):
+    # Mini-batch k-means: every centre is the running mean of all the rows
+    # ever assigned to it, updated one chunk at a time.
+    def step(state, chunk):
+        centers, seen = state["centers"].copy(), state["seen"].copy()
+        vectors = load_vectors(checkpoint, chunk)
+        labels = nearest_centers(vectors, centers)
+        counts = np.bincount(labels, minlength=len(centers))
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, vectors)
+        seen += counts
+        moved = counts > 0
+        centers[moved] += (sums[moved] - counts[moved, np.newaxis] * centers[moved]) / seen[moved, np.newaxis]
+        return {"centers": centers, "seen": seen}
+    return step
+
+
+def labels_function(checkpoint, centers):
+    def function(chunk):
+        labels = nearest_centers(load_vectors(checkpoint, chunk), centers)
+        save_arrays(checkpoint.chunk_path(chunk, "labels.npz"), labels=labels.astype(np.int32))
+    return function
+
+
+def select_step(checkpoint, offsets, num_clusters):
+    # Folds group_costs over chunks. The longest test per cluster only changes
+    # for a strictly longer one, so ties keep the earliest test as in main().
+    def step(state, chunk):
+        labels = load_arrays(checkpoint.chunk_path(chunk, "labels.npz"))["labels"]
+        costs = load_arrays(checkpoint.chunk_path(chunk, "costs.npz"))["costs"]
+        counts, totals, maxima, argmax = group_costs(labels, costs, num_clusters)
+        longer = (argmax >= 0) & ((state["argmax"] < 0) | (maxima > state["maxima"]))
+        return {"counts": state["counts"] + counts, "totals": state["totals"] + totals,
+                "maxima": np.where(longer, maxima, state["maxima"]),
+                "argmax": np.where(longer, argmax + offsets[chunk], state["argmax"])}
+    return step
+
+
+def names_of(checkpoint, offsets, test_ids):
+    # Test names for sorted global ids, reading only the chunks they fall in.
+    names = []
+    for chunk in np.unique(np.searchsorted(offsets, test_ids, side='right') - 1).tolist():
+        chunk_names = load_lines(checkpoint.chunk_path(chunk, "names"))
+        names.extend(chunk_names[test_id - offsets[chunk]] for test_id in test_ids.tolist()
+                     if offsets[chunk] <= test_id < offsets[chunk + 1])
+    return names
+
+
+def run(config_path, workdir, num_clusters=1000, chunk_size=DEFAULT_CHUNK_SIZE, dims=DEFAULT_DIMS,
+        epochs=DEFAULT_EPOCHS, n_features=DEFAULT_FEATURES, seed=0, workers=1, plan_path=None):
+    settings = {"config": os.path.abspath(config_path), "size": os.path.getsize(config_path),
+                "mtime": os.path.getmtime(config_path), "clusters": num_clusters, "chunk_size": chunk_size,
+                "dims": dims, "epochs": epochs, "features": n_features, "seed": seed, "format": CHECKPOINT_FORMAT}
+    checkpoint = Checkpoint(workdir, settings)
+    if checkpoint.resumed:
+        print("Resuming from {}".format(checkpoint.manifest_path))
+
+    sizes = parse_stage(checkpoint, config_path, chunk_size)
+    num_chunks = len(sizes)
+    offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    num_tests = int(offsets[-1])
+    print("Tests: {} in {} chunks".format(num_tests, num_chunks))
+    if not num_tests:
+        return
+    if not all(checkpoint.done("costs:{}".format(chunk)) for chunk in range(num_chunks)):
+        map_chunks(checkpoint, "costs", num_chunks, costs_function(checkpoint, num_chunks))
+
+    frequencies = fold_chunks(checkpoint, "frequency", num_chunks,
+                              {"counts": np.zeros(n_features, dtype=np.int64), "documents": np.int64(0)},
+                              frequency_step(checkpoint, n_features, workers))
+    idf = smoothed_idf(frequencies["counts"], int(frequencies["documents"]))
+    map_chunks(checkpoint, "vectors", num_chunks,
+               vectors_function(checkpoint, n_features, idf, Projection("random", dims, seed)))
+
+    num_clusters = min(num_clusters, num_tests)
+    if not checkpoint.done("kmeans_init"):
+        save_arrays(checkpoint.path("kmeans_init.npz"),
+                    centers=initial_centers(checkpoint, num_chunks, num_clusters, seed), seen=np.zeros(num_clusters))
+        checkpoint.complete("kmeans_init")
+    state = load_arrays(checkpoint.path("kmeans_init.npz"))
+    for epoch in range(epochs):
+        state = fold_chunks(checkpoint, "kmeans{}".format(epoch), num_chunks, state, kmeans_step(checkpoint))
+    map_chunks(checkpoint, "labels", num_chunks, labels_function(checkpoint, state["centers"]))
+
+    costs = fold_chunks(checkpoint, "select", num_chunks,
+                        {"counts": np.zeros(num_clusters, dtype=np.int64), "totals": np.zeros(num_clusters),
+                         "maxima": np.zeros(num_clusters), "argmax": np.full(num_clusters, -1, dtype=np.int64)},
+                        select_step(checkpoint, offsets, num_clusters))
+    selected = np.sort(costs["argmax"][costs["argmax"] >= 0])
+    plan_path = plan_path or checkpoint.path("plan.txt")
+    save_lines(plan_path, names_of(checkpoint, offsets, selected))
+    print("Clusters: {} non-empty of {}".format(int((costs["counts"] > 0).sum()), num_clusters))
+    print("Normal Execution Time: {:.0f} seconds".format(costs["totals"].sum()))
+    print("Optimized Execution Time: {:.0f} seconds".format(costs["maxima"][costs["argmax"] >= 0].sum()))
+    print("Plan: {} tests written to {}".format(len(selected), plan_path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='cluster and reduce a test inventory too large for memory, '
+                                                 'resuming an interrupted run from its work directory')
+    parser.add_argument('--config', required=True)
+    parser.add_argument('--workdir', required=True, help='chunk files and the checkpoint manifest')
+    parser.add_argument('--clusters', type=int, default=1000)
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='tests per chunk')
+    parser.add_argument('--dims', type=int, default=DEFAULT_DIMS, help='random projection dimensions')
+    parser.add_argument('--epochs', type=int, default=DEFAULT_EPOCHS, help='mini-batch k-means passes')
+    parser.add_argument('--hash-features', type=int, default=DEFAULT_FEATURES)
+    parser.add_argument('--workers', type=int, default=1, help='processes hashing each chunk')
+    parser.add_argument('--plan', help='where to write the selected test names; defaults to <workdir>/plan.txt')
+    parser.add_argument('--profile', help='write a per-stage trace here (Chrome trace, or speedscope for *.speedscope.json)')
+    args = parser.parse_args()
+    if args.profile:
+        profiling.enable()
+    run(args.config, args.workdir, args.clusters, args.chunk_size, args.dims, args.epochs, args.hash_features,
+        workers=args.workers, plan_path=args.plan)
+    if args.profile:
+        profiler = profiling.disable()
+        profiler.export(args.profile)
+        print(profiler.summary())
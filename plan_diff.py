@@ -0,0 +1,161 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import subprocess
+import time
+
+import numpy as np
+from scipy import sparse
+
+from catalogue import Catalogue
+from config_resolver import is_test_key, resolve_test_case
+from config_store import ConfigStore
+from cost_aggregation import group_costs
+from test_optimization import (combine_attributes, cosine_similarity, extract_test_cases, fit_unique_vectors,
+                               kmeans_fit, load_config)
+
+DIGEST_SIZE = 16
+
+
+def entry_digest(entry):
+    # Everything a test's cluster depends on: the attributes that are
+    # vectorised. Its cost only decides representatives and is compared
+    # separately.
+    return hashlib.blake2b(combine_attributes(entry).encode(), digest_size=DIGEST_SIZE).digest()
+
+
+def load_snapshot(config_path, revision=None):
+    # The test entries and their resolved costs in the config as committed at
+    # revision, or as it is on disk.
+    if revision is None:
+        config = load_config(config_path)
+    else:
+        text = subprocess.check_output(["git", "show", "{}:./{}".format(revision, os.path.basename(config_path))],
+                                       cwd=os.path.dirname(config_path) or '.', text=True)
+        config = ConfigStore().load(io.StringIO(text))
+    test_cases = extract_test_cases(config)
+    catalogue = Catalogue(test_cases, {key: resolve_test_case(config, key) for key in test_cases if is_test_key(key)})
+    return test_cases, dict(zip(catalogue.names.strings, catalogue.cost.tolist()))
+
+
+def cluster_plan(test_cases, num_clusters):
+    # Labels as test_optimization.py computes them by default.
+    vectors, weights, inverse, _ = fit_unique_vectors(test_cases)
+    return kmeans_fit(cosine_similarity(vectors) * np.sqrt(weights), num_clusters, weights, inverse)
+
+
+def base_labels(test_cases, digests, num_clusters, cache_path=None):
+    # A cached base plan is reused while its tests and digests still match.
+    names = np.array(list(test_cases), dtype=str)
+    if cache_path and os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            if (int(cached["clusters"]) == num_clusters and np.array_equal(cached["names"], names)
+                    and cached["digests"].tobytes() == b"".join(digests)):
+                return cached["labels"]
+    labels = cluster_plan(test_cases, num_clusters)
+    if cache_path:
+        with open(cache_path + ".tmp", 'wb') as file:
+            np.savez(file, clusters=num_clusters, names=names, labels=labels,
+                     digests=np.frombuffer(b"".join(digests), dtype=np.uint8).reshape(len(names), DIGEST_SIZE))
+        os.replace(cache_path + ".tmp", cache_path)
+    return labels
+
+
+def assign_to_clusters(test_cases, labels, kept, moving):
+    # Each moving test joins the cluster whose centroid over its kept members
+    # is most similar. labels holds the base label of kept tests.
+    vectors, _, inverse, _ = fit_unique_vectors(test_cases)
+    rows = inverse[kept]
+    membership = sparse.csr_matrix((np.ones(len(kept)), (labels[kept], rows)),
+                                   shape=(int(labels.max()) + 1, vectors.shape[0]))
+    centroids = membership @ vectors
+    norms = np.sqrt(np.asarray((centroids.multiply(centroids) if sparse.issparse(centroids)
+                                else centroids * centroids).sum(axis=1)).ravel())
+    norms[norms == 0] = np.inf
+    similarity = vectors[inverse[moving]] @ centroids.T
+    similarity = similarity.toarray() if sparse.issparse(similarity) else np.asarray(similarity)
+    return np.argmax(similarity / norms, axis=1)
+
+
+def affected_costs(labels, costs, clusters):
+    # Longest test and its cost for each listed cluster (-1 and 0 if empty).
+    mask = np.isin(labels, clusters)
+    members = np.flatnonzero(mask)
+    _, _, maxima, argmax = group_costs(labels[mask], costs[mask], int(labels.max()) + 1 if len(labels) else 0)
+    representatives = np.where(argmax[clusters] >= 0, members[np.maximum(argmax[clusters], 0)], -1)
+    return representatives, maxima[clusters]
+
+
+def plan_diff(old_cases, new_cases, old_times, new_times, num_clusters=8, cache_path=None):
+    # old_times and new_times are the resolved costs of each version's tests.
+    old_names, new_names = list(old_cases), list(new_cases)
+    old_digests = [entry_digest(old_cases[name]) for name in old_names]
+    new_digests = [entry_digest(new_cases[name]) for name in new_names]
+    old_digest_of = dict(zip(old_names, old_digests))
+    old_labels = base_labels(old_cases, old_digests, num_clusters, cache_path)
+    old_label_of = dict(zip(old_names, old_labels.tolist()))
+    old_costs = np.array([old_times[name] for name in old_names], dtype=np.float64)
+    new_costs = np.array([new_times[name] for name in new_names], dtype=np.float64)
+
+    kept = np.array([old_digest_of.get(name) == digest for name, digest in zip(new_names, new_digests)], dtype=bool)
+    added = [name for name in new_names if name not in old_digest_of]
+    removed = [name for name in old_names if name not in new_cases]
+    changed = [name for name, keep in zip(new_names, kept.tolist()) if not keep and name in old_digest_of]
+    # Tests whose features are unchanged but whose resolved cost changed keep
+    # their cluster and are only costed again.
+    recosted = [name for name, keep in zip(new_names, kept.tolist()) if keep and new_times[name] != old_times[name]]
+
+    # Unchanged tests keep their cluster; only the rest are placed again.
+    new_labels = np.array([old_label_of.get(name, -1) for name in new_names], dtype=np.int64)
+    moving = np.flatnonzero(~kept)
+    if len(moving):
+        if kept.any():
+            new_labels[moving] = assign_to_clusters(new_cases, np.where(kept, new_labels, 0), np.flatnonzero(kept),
+                                                    moving)
+        else:
+            new_labels = cluster_plan(new_cases, num_clusters)
+
+    affected = sorted({old_label_of[name] for name in changed + removed + recosted} | set(new_labels[moving].tolist()))
+    affected = np.array(affected, dtype=np.int64)
+    old_representatives, old_maxima = affected_costs(old_labels, old_costs, affected)
+    new_representatives, new_maxima = affected_costs(new_labels, new_costs, affected)
+    old_optimized = float(group_costs(old_labels, old_costs)[2].sum())
+    new_optimized = old_optimized - float(old_maxima.sum()) + float(new_maxima.sum())
+
+    def name_of(names, test_id):
+        return names[test_id] if test_id >= 0 else None
+
+    return {
+        "tests": {"old": len(old_names), "new": len(new_names), "added": added, "removed": removed,
+                  "changed": changed, "recosted": recosted},
+        "moved": {new_names[test_id]: [old_label_of.get(new_names[test_id]), int(new_labels[test_id])]
+                  for test_id in moving.tolist() if old_label_of.get(new_names[test_id]) != new_labels[test_id]},
+        "representatives": {str(cluster): [name_of(old_names, old_id), name_of(new_names, new_id)]
+                            for cluster, old_id, new_id in zip(affected.tolist(), old_representatives.tolist(),
+                                                               new_representatives.tolist())
+                            if name_of(old_names, old_id) != name_of(new_names, new_id)},
+        "affected_clusters": affected.tolist(),
+        "time": {"normal": {"old": float(old_costs.sum()), "new": float(new_costs.sum()),
+                            "delta": float(new_costs.sum() - old_costs.sum())},
+                 "optimized": {"old": old_optimized, "new": new_optimized, "delta": new_optimized - old_optimized}},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='show how the optimized plan changes between two config versions')
+    parser.add_argument('configs', nargs='+', metavar='CONFIG', help='old and new config, or the new config with --base')
+    parser.add_argument('--base', metavar='REV', help='take the old config from this git revision of CONFIG')
+    parser.add_argument('--clusters', type=int, default=8)
+    parser.add_argument('--base-plan', metavar='PATH', help='cache of the base plan, reused while its tests are unchanged')
+    args = parser.parse_args()
+    if len(args.configs) != (1 if args.base else 2):
+        parser.error('give OLD NEW, or CONFIG with --base REV')
+
+    started = time.perf_counter()
+    old_cases, old_times = load_snapshot(args.configs[0], args.base)
+    new_cases, new_times = load_snapshot(args.configs[-1])
+    diff = plan_diff(old_cases, new_cases, old_times, new_times, args.clusters, args.base_plan)
+    diff["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    print(json.dumps(diff, indent=1))
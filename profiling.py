@@ -0,0 +1,139 @@
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+# Stage instrumentation. While no profiler is active, span() hands back one
+# shared no-op context manager, so instrumented code costs a global lookup and
+# a function call per stage.
+PROFILER = None
+
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def count(self, items):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+class Span(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.items = None
+
+    def __enter__(self):
+        self.depth = self.profiler.push()
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.rss_start = peak_rss_kb()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter()
+        self.profiler.pop({
+            "name": self.name,
+            "depth": self.depth,
+            "start": self.start - self.profiler.origin,
+            "wall": end - self.start,
+            "cpu": time.process_time() - self.cpu_start,
+            # ru_maxrss is a process-lifetime high-water mark: max_rss_kb is its
+            # value when the stage ended, rss_growth_kb how far the stage raised
+            # it (0 when the stage stayed below an earlier peak).
+            "max_rss_kb": peak_rss_kb(),
+            "rss_growth_kb": peak_rss_kb() - self.rss_start,
+            "items": self.items,
+            "tid": threading.get_ident(),
+        })
+        return False
+
+    def count(self, items):
+        self.items = items
+
+
+class Profiler(object):
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.records = []
+        self.local = threading.local()
+
+    def push(self):
+        depth = getattr(self.local, "depth", 0)
+        self.local.depth = depth + 1
+        return depth
+
+    def pop(self, record):
+        self.local.depth -= 1
+        self.records.append(record)
+
+    def chrome_trace(self):
+        events = []
+        for record in self.records:
+            args = {"cpu_ms": record["cpu"] * 1000, "max_rss_kb": record["max_rss_kb"],
+                    "rss_growth_kb": record["rss_growth_kb"]}
+            if record["items"] is not None:
+                args["items"] = record["items"]
+            events.append({"name": record["name"], "ph": "X", "pid": os.getpid(), "tid": record["tid"],
+                           "ts": record["start"] * 1e6, "dur": record["wall"] * 1e6, "args": args})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def speedscope(self):
+        frames = sorted({record["name"] for record in self.records})
+        frame_ids = {name: idx for idx, name in enumerate(frames)}
+        events = []
+        for record in self.records:
+            start, end = record["start"] * 1e6, (record["start"] + record["wall"]) * 1e6
+            events.append((start, 1, record["depth"], {"type": "O", "frame": frame_ids[record["name"]], "at": start}))
+            events.append((end, 0, -record["depth"], {"type": "C", "frame": frame_ids[record["name"]], "at": end}))
+        events.sort(key=lambda event: event[:3])
+        end_value = max([event[0] for event in events] or [0])
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": [{"name": name} for name in frames]},
+            "profiles": [{"type": "evented", "name": "test_optimization", "unit": "microseconds",
+                          "startValue": 0, "endValue": end_value, "events": [event[3] for event in events]}],
+        }
+
+    def export(self, path):
+        trace = self.speedscope() if path.endswith(".speedscope.json") else self.chrome_trace()
+        with open(path, 'w') as file:
+            json.dump(trace, file)
+
+    def summary(self):
+        stages = ", ".join("{} {:.1f}ms".format(record["name"], record["wall"] * 1000)
+                           for record in sorted(self.records, key=lambda record: record["start"])
+                           if record["depth"] == 0)
+        return "Profile: {} | total {:.1f}ms, peak RSS {:.1f} MB".format(
+            stages, (time.perf_counter() - self.origin) * 1000, peak_rss_kb() / 1024.0)
+
+
+def span(name):
+    if PROFILER is None:
+        return NULL_SPAN
+    return Span(PROFILER, name)
+
+
+def enable():
+    global PROFILER
+    PROFILER = Profiler()
+    return PROFILER
+
+
+def disable():
+    global PROFILER
+    profiler, PROFILER = PROFILER, None
+    return profiler
@@ -0,0 +1,125 @@
+import hashlib
+import os
+
+import numpy as np
+from scipy import sparse
+
+METHODS = ("random", "svd")
+DEFAULT_COMPONENTS = 256
+# Non-zeros per term in the sparse random projection (a sparse
+# Johnson-Lindenstrauss embedding: each term adds +-1/sqrt(s) to s columns).
+SPARSE_NONZEROS = 8
+SVD_OVERSAMPLES = 10
+SVD_POWER_ITERATIONS = 4
+MIN_KNOWN_TERMS = 0.5
+GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+
+
+def splitmix64(values):
+    values = values + GOLDEN_GAMMA
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+def term_hashes(terms, seed):
+    digests = b"".join(hashlib.blake2b(term.encode(), digest_size=8, key=str(seed).encode()).digest()
+                       for term in terms)
+    return np.frombuffer(digests, dtype=np.uint64).copy()
+
+
+def random_projection_rows(terms, n_components, seed=0):
+    # A term's row depends only on the term and the seed, so vocabularies that
+    # grow between runs still project consistently without a refit.
+    nonzeros = min(SPARSE_NONZEROS, n_components)
+    with np.errstate(over='ignore'):
+        keys = splitmix64(term_hashes(terms, seed)[:, np.newaxis]
+                          + np.arange(nonzeros, dtype=np.uint64) * GOLDEN_GAMMA)
+    columns = (keys % np.uint64(n_components)).astype(np.int64)
+    signs = np.where(keys >> np.uint64(63), 1.0, -1.0) / np.sqrt(nonzeros)
+    rows = np.repeat(np.arange(len(terms)), nonzeros)
+    return sparse.csr_matrix((signs.ravel(), (rows, columns.ravel())), shape=(len(terms), n_components))
+
+
+def randomized_svd_components(vectors, n_components, weights=None, seed=0):
+    # Halko et al. range finder with power iterations; duplicates count through
+    # sqrt(weight) row scaling. Returns the top right singular vectors as a
+    # (features, components) matrix.
+    if weights is not None:
+        vectors = sparse.diags(np.sqrt(weights)) @ vectors
+    n_samples, n_features = vectors.shape
+    size = min(n_components + SVD_OVERSAMPLES, n_samples, n_features)
+    random_state = np.random.RandomState(seed)
+    basis = np.linalg.qr(vectors @ random_state.normal(size=(n_features, size)))[0]
+    for _ in range(SVD_POWER_ITERATIONS):
+        basis = np.linalg.qr(vectors @ np.asarray(vectors.T @ basis))[0]
+    _, _, right = np.linalg.svd(np.asarray((vectors.T @ basis).T), full_matrices=False)
+    return right[:n_components].T
+
+
+class Projection(object):
+    # Maps TF-IDF vectors with named columns (terms) to a few hundred dense,
+    # unit-norm dimensions. Saved projections are reused across runs: the
+    # random projection is a pure function of each term, and the SVD keeps its
+    # fitted terms, so terms it has never seen project to nothing until a refit.
+    # updated is set whenever fit() changed what save() would write.
+    def __init__(self, method="random", n_components=DEFAULT_COMPONENTS, seed=0, terms=None, components=None):
+        if method not in METHODS:
+            raise ValueError("unknown projection method {}".format(method))
+        self.method = method
+        self.n_components = n_components
+        self.seed = seed
+        self.terms = terms
+        self.components = components
+        self.updated = False
+
+    def fits(self, terms):
+        # The SVD is refitted once fewer than MIN_KNOWN_TERMS of the current
+        # terms were seen when it was fitted.
+        if self.method == "random":
+            return True
+        if self.components is None:
+            return False
+        known = set(self.terms)
+        return sum(term in known for term in terms) >= MIN_KNOWN_TERMS * len(terms)
+
+    def fit(self, vectors, terms, weights=None):
+        if self.method == "svd":
+            self.terms = list(terms)
+            self.components = randomized_svd_components(vectors, self.n_components, weights, self.seed)
+        self.updated = True
+        return self
+
+    def matrix(self, terms):
+        if self.method == "random":
+            return random_projection_rows(terms, self.n_components, self.seed)
+        term_index = {term: idx for idx, term in enumerate(self.terms)}
+        rows = np.array([term_index.get(term, -1) for term in terms], dtype=np.int64)
+        matrix = np.zeros((len(terms), self.components.shape[1]))
+        matrix[rows >= 0] = self.components[rows[rows >= 0]]
+        return matrix
+
+    def transform(self, vectors, terms):
+        projected = vectors @ self.matrix(terms)
+        projected = projected.toarray() if sparse.issparse(projected) else np.asarray(projected)
+        norms = np.sqrt(np.einsum("ij,ij->i", projected, projected))
+        norms[norms == 0] = 1.0
+        return projected / norms[:, np.newaxis]
+
+    def save(self, path):
+        with open(path + ".tmp", 'wb') as file:
+            np.savez(file, method=self.method, n_components=self.n_components, seed=self.seed,
+                     terms=np.array(self.terms or [], dtype=str),
+                     components=self.components if self.components is not None else np.zeros((0, 0)))
+        os.replace(path + ".tmp", path)
+
+
+def load_projection(path, method, n_components, seed=0):
+    # A saved projection is reused only when it was made with the same settings.
+    if not path or not os.path.exists(path):
+        return None
+    with np.load(path) as saved:
+        if (str(saved["method"]), int(saved["n_components"]), int(saved["seed"])) != (method, n_components, seed):
+            return None
+        components = saved["components"] if saved["components"].size else None
+        return Projection(method, n_components, seed, saved["terms"].tolist(), components)
@@ -0,0 +1,131 @@
+import numpy as np
+from scipy import sparse
+
+from coverage_selection import subset_rows
+
+STRATEGIES = ("longest", "medoid", "cover")
+
+
+def row_dots(a, b):
+    if sparse.issparse(a):
+        return np.asarray(a.multiply(b).sum(axis=1)).ravel()
+    return np.einsum("ij,ij->i", a, b)
+
+
+def centroid_distances(vectors, labels, num_clusters):
+    # Squared distance of every row to its own cluster centroid, from one
+    # sparse membership product instead of a loop over clusters.
+    counts = np.bincount(labels, minlength=num_clusters)
+    membership = sparse.csr_matrix((1.0 / counts[labels], (labels, np.arange(len(labels)))),
+                                   shape=(num_clusters, len(labels)))
+    centroids = membership @ vectors
+    own = centroids[labels]
+    return np.maximum(row_dots(vectors, vectors) - 2.0 * row_dots(vectors, own) + row_dots(own, own), 0.0)
+
+
+def group_first(labels, *keys):
+    # Row that sorts first within each label, ordered by keys (last key primary
+    # after the label), for every label present.
+    order = np.lexsort(keys + (labels,))
+    starts = np.flatnonzero(np.r_[True, labels[order][1:] != labels[order][:-1]])
+    return order[starts]
+
+
+def farthest_first(vectors, labels, num_clusters, chosen, max_representatives, spread, runnable):
+    # Adds representatives to clusters whose farthest member is still further
+    # than spread from every representative, one round per extra pick. Rows
+    # that are not runnable are never added.
+    radius = 2.0 * (1.0 - spread) if spread is not None else 0.0
+    first = np.full(num_clusters, -1, dtype=np.int64)
+    first[labels[chosen]] = chosen
+    nearest = np.maximum(row_dots(vectors, vectors) - 2.0 * row_dots(vectors, vectors[first[labels]])
+                         + row_dots(vectors[first[labels]], vectors[first[labels]]), 0.0)
+    nearest[~runnable] = -1.0
+    picked = np.zeros(len(labels), dtype=bool)
+    picked[chosen] = True
+    chosen = list(chosen)
+    for _ in range(max_representatives - 1):
+        farthest = group_first(labels, -nearest)
+        farthest = farthest[(nearest[farthest] > radius + 1e-12) & ~picked[farthest]]
+        if not farthest.size:
+            break
+        picked[farthest] = True
+        chosen.extend(farthest)
+        new = np.full(num_clusters, -1, dtype=np.int64)
+        new[labels[farthest]] = farthest
+        rows = np.flatnonzero(new[labels] >= 0)
+        reps = vectors[new[labels[rows]]]
+        distances = np.maximum(row_dots(vectors[rows], vectors[rows]) - 2.0 * row_dots(vectors[rows], reps)
+                               + row_dots(reps, reps), 0.0)
+        nearest[rows] = np.minimum(nearest[rows], distances)
+    return np.asarray(chosen, dtype=np.int64)
+
+
+def cheapest_cover(labels, num_clusters, costs, runnable, indptr, indices):
+    # Greedy weighted set cover run for all clusters at once: every round each
+    # cluster with uncovered items takes its best gain/cost member. Items are
+    # (cluster, item) pairs so one cluster's picks never cover another's.
+    rows = np.repeat(np.arange(len(labels)), np.diff(indptr))
+    _, pairs = np.unique(labels[rows] * (int(indices.max()) + 1 if indices.size else 1) + indices,
+                         return_inverse=True)
+    covered = np.zeros(pairs.max() + 1 if pairs.size else 0, dtype=bool)
+    costs = np.maximum(costs, 1.0)
+    picked = np.zeros(len(labels), dtype=bool)
+    chosen = []
+    active = np.ones(num_clusters, dtype=bool)
+    while active.any():
+        gains = np.bincount(rows, weights=~covered[pairs], minlength=len(labels))
+        candidates = np.flatnonzero(active[labels] & ~picked)
+        if not candidates.size:
+            break
+        ratios = gains[candidates] / costs[candidates]
+        best = candidates[group_first(labels[candidates], costs[candidates], -ratios, ~runnable[candidates])]
+        # The first round gives every cluster a test even when it covers nothing.
+        if chosen:
+            best = best[gains[best] > 0]
+        picked[best] = True
+        chosen.extend(best)
+        covered[pairs[picked[rows]]] = True
+        remaining = np.bincount(labels[rows], weights=~covered[pairs], minlength=num_clusters)
+        active = remaining > 0
+    return np.asarray(chosen, dtype=np.int64)
+
+
+def align_coverage(coverage_keys, indptr, indices, test_case_keys):
+    # Reorders build_coverage rows to test_case_keys; tests without a coverage
+    # row (class entries) map to a trailing empty row.
+    row_of = {key: row for row, key in enumerate(coverage_keys)}
+    rows = [row_of.get(key, len(coverage_keys)) for key in test_case_keys]
+    return subset_rows(np.append(indptr, indptr[-1]), indices, rows)
+
+
+def choose_representatives(labels, costs, vectors=None, strategy="longest", max_representatives=1, spread=None,
+                           coverage=None, scores=None, runnable=None):
+    # Row ids of the representatives of every non-empty cluster. vectors has
+    # one row per label and is needed by "medoid" and extra representatives;
+    # coverage is (indptr, indices) aligned to the rows and needed by "cover".
+    # With scores, "longest" takes the likeliest failure, then the longest.
+    # Rows that are not runnable (class entries) never represent a cluster; a
+    # cluster without a runnable member has no representative.
+    labels = np.asarray(labels, dtype=np.int64)
+    costs = np.asarray(costs, dtype=np.float64)
+    if not len(labels):
+        return np.zeros(0, dtype=np.int64)
+    num_clusters = int(labels.max()) + 1
+    runnable = np.ones(len(labels), dtype=bool) if runnable is None else np.asarray(runnable, dtype=bool)
+
+    if strategy == "longest":
+        chosen = group_first(labels, -costs, ~runnable) if scores is None else \
+            group_first(labels, -costs, -scores, ~runnable)
+    elif strategy == "medoid":
+        chosen = group_first(labels, costs, centroid_distances(vectors, labels, num_clusters), ~runnable)
+    elif strategy == "cover":
+        chosen = cheapest_cover(labels, num_clusters, costs, runnable, *coverage)
+    else:
+        raise ValueError("unknown representative strategy {}".format(strategy))
+
+    chosen = np.asarray(chosen, dtype=np.int64)
+    chosen = chosen[runnable[chosen]]
+    if max_representatives > 1 and strategy != "cover":
+        chosen = farthest_first(vectors, labels, num_clusters, chosen, max_representatives, spread, runnable)
+    return np.asarray(chosen, dtype=np.int64)
@@ -0,0 +1,239 @@
+import argparse
+import io
+import os
+import socket
+import socketserver
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+import numpy_backend
+
+# Map-reduce k-means over contiguous shards of the feature rows:
+#   fit     each shard fits LOCAL_OVERSAMPLE * k weighted k-means centroids
+#   reduce  weighted k-means over all shard centroids gives k global ones
+#   assign  each shard labels its rows with the nearest global centroid and
+#           returns per-centroid weighted sums; refine rounds turn those into
+#           new centroids (a distributed Lloyd step) before the final labels
+# Shard operations are pure functions of arrays, so they run in-process, in a
+# local process pool, or on remote workers speaking a length-prefixed npz
+# protocol over TCP.
+LOCAL_OVERSAMPLE = 2
+SHARD_RESTARTS = 3
+DEFAULT_REFINE_ROUNDS = 2
+DEFAULT_PORT = 8643
+# Rows x centroids per block of the nearest-centroid search.
+DISTANCE_BLOCK = 1 << 22
+
+
+def shard_rows(arrays):
+    # Dense rows, or CSR rows sent as data, indices, indptr and shape.
+    if "rows" in arrays:
+        return arrays["rows"]
+    return sparse.csr_matrix((arrays["data"], arrays["indices"], arrays["indptr"]),
+                             shape=tuple(arrays["shape"])).toarray()
+
+
+def nearest_centers(rows, centers):
+    # Labels and squared distances to the nearest centre, in row blocks.
+    block = max(1, DISTANCE_BLOCK // len(centers))
+    labels = np.empty(len(rows), dtype=np.int64)
+    distances = np.empty(len(rows))
+    for start in range(0, len(rows), block):
+        block_distances = numpy_backend.squared_distances(rows[start:start + block], centers)
+        labels[start:start + block] = np.argmin(block_distances, axis=1)
+        distances[start:start + block] = block_distances[np.arange(len(block_distances)),
+                                                         labels[start:start + block]]
+    return labels, distances
+
+
+def fit_shard(arrays):
+    rows, weights = shard_rows(arrays), arrays["weights"]
+    num_clusters = min(int(arrays["clusters"]), len(rows))
+    kmeans = numpy_backend.KMeans(num_clusters, random_state=int(arrays["seed"]), n_init=SHARD_RESTARTS)
+    kmeans.fit(rows, weights)
+    return {"centers": kmeans.cluster_centers_,
+            "weights": np.bincount(kmeans.labels_, weights=weights, minlength=num_clusters)}
+
+
+def assign_shard(arrays):
+    rows, weights, centers = shard_rows(arrays), arrays["weights"], arrays["centers"]
+    labels, distances = nearest_centers(rows, centers)
+    sums = np.zeros_like(centers)
+    np.add.at(sums, labels, rows * weights[:, np.newaxis])
+    return {"labels": labels, "sums": sums, "weights": np.bincount(labels, weights=weights, minlength=len(centers)),
+            "inertia": np.array(distances @ weights)}
+
+
+SHARD_OPERATIONS = {"fit": fit_shard, "assign": assign_shard}
+
+
+def run_operation(operation, arrays):
+    return SHARD_OPERATIONS[operation](arrays)
+
+
+def encode_message(arrays):
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    payload = buffer.getvalue()
+    return struct.pack(">Q", len(payload)) + payload
+
+
+def read_message(file):
+    # None once the peer has closed the connection. Arrays only: object
+    # arrays are refused, so a message cannot run code when loaded.
+    header = file.read(8)
+    if len(header) < 8:
+        return None
+    payload = file.read(struct.unpack(">Q", header)[0])
+    with np.load(io.BytesIO(payload), allow_pickle=False) as message:
+        return {name: message[name] for name in message.files}
+
+
+class ShardHandler(socketserver.StreamRequestHandler):
+    # One connection carries any number of request/response messages.
+    def handle(self):
+        while True:
+            request = read_message(self.rfile)
+            if request is None:
+                return
+            try:
+                response = run_operation(str(request.pop("op")), request)
+            except (KeyError, ValueError) as error:
+                response = {"error": np.array("{}: {}".format(type(error).__name__, error))}
+            self.wfile.write(encode_message(response))
+
+
+class ShardServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_local_workers(count):
+    # Shard servers on ephemeral localhost ports, served from threads of this
+    # process: a stand-in for remote hosts that exercises the same protocol.
+    servers = [ShardServer(("127.0.0.1", 0), ShardHandler) for _ in range(count)]
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return servers, ["127.0.0.1:{}".format(server.server_address[1]) for server in servers]
+
+
+class RemoteWorker(object):
+    def __init__(self, address):
+        host, _, port = address.rpartition(":")
+        self.address = (host or "127.0.0.1", int(port))
+        self.connection = None
+        self.file = None
+
+    def run(self, operation, arrays):
+        if self.connection is None:
+            self.connection = socket.create_connection(self.address)
+            self.file = self.connection.makefile('rb')
+        self.connection.sendall(encode_message(dict(arrays, op=np.array(operation))))
+        response = read_message(self.file)
+        if response is None:
+            raise ConnectionError("shard worker {}:{} closed the connection".format(*self.address))
+        if "error" in response:
+            raise RuntimeError("shard worker {}:{}: {}".format(self.address[0], self.address[1], response["error"]))
+        return response
+
+    def close(self):
+        if self.connection is not None:
+            self.file.close()
+            self.connection.close()
+            self.connection = None
+
+
+def run_tasks(operation, tasks, workers=1, remotes=None):
+    # Results in task order. Remote workers take every len(remotes)-th task,
+    # one request at a time each.
+    if remotes:
+        def run_remote(index):
+            return [(task, remotes[index].run(operation, tasks[task]))
+                    for task in range(index, len(tasks), len(remotes))]
+        results = [None] * len(tasks)
+        with ThreadPoolExecutor(len(remotes)) as pool:
+            for batch in pool.map(run_remote, range(len(remotes))):
+                for task, result in batch:
+                    results[task] = result
+        return results
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(min(workers, len(tasks))) as pool:
+            return list(pool.map(run_operation, [operation] * len(tasks), tasks))
+    return [run_operation(operation, task) for task in tasks]
+
+
+def shard_tasks(features, weights, shards):
+    bounds = np.linspace(0, features.shape[0], shards + 1).astype(np.int64)
+    tasks = []
+    for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        if sparse.issparse(features):
+            rows = sparse.csr_matrix(features[start:end])
+            task = {"data": rows.data, "indices": rows.indices, "indptr": rows.indptr, "shape": np.array(rows.shape)}
+        else:
+            task = {"rows": np.asarray(features[start:end], dtype=np.float64)}
+        task["weights"] = weights[start:end]
+        tasks.append(task)
+    return tasks
+
+
+def sharded_kmeans(features, num_clusters, weights=None, shards=4, workers=None, hosts=None,
+                   rounds=DEFAULT_REFINE_ROUNDS, seed=0):
+    # Returns labels, centroids and the weighted inertia. hosts are
+    # "host:port" shard workers; without them shards run in up to workers
+    # local processes (one per core by default).
+    num_rows = features.shape[0]
+    weights = np.ones(num_rows) if weights is None else np.asarray(weights, dtype=np.float64)
+    shards = max(1, min(shards, num_rows))
+    if workers is None:
+        workers = min(shards, os.cpu_count() or 1)
+    tasks = shard_tasks(features, weights, shards)
+    remotes = [RemoteWorker(address) for address in hosts or ()]
+    try:
+        fitted = run_tasks("fit", [dict(task, clusters=np.array(LOCAL_OVERSAMPLE * num_clusters),
+                                        seed=np.array(seed)) for task in tasks], workers, remotes)
+        local_centers = np.concatenate([result["centers"] for result in fitted])
+        local_weights = np.concatenate([result["weights"] for result in fitted])
+        local_centers, local_weights = local_centers[local_weights > 0], local_weights[local_weights > 0]
+        reduce = numpy_backend.KMeans(min(num_clusters, len(local_centers)), random_state=seed)
+        centers = reduce.fit(local_centers, local_weights).cluster_centers_
+        for _ in range(rounds + 1):
+            assigned = run_tasks("assign", [dict(task, centers=centers) for task in tasks], workers, remotes)
+            sums = sum(result["sums"] for result in assigned)
+            totals = sum(result["weights"] for result in assigned)
+            moved = totals > 0
+            centers = centers.copy()
+            centers[moved] = sums[moved] / totals[moved, np.newaxis]
+    finally:
+        for remote in remotes:
+            remote.close()
+    # The final labels and inertia are those of the last assignment; its
+    # centroid update only serves the caller.
+    labels = np.concatenate([result["labels"] for result in assigned])
+    return labels, centers, float(sum(result["inertia"] for result in assigned))
+
+
+def weighted_inertia(features, labels, weights=None):
+    # Weighted squared distance of every row to its cluster's weighted mean,
+    # for comparing labelings of the same rows.
+    rows = features.toarray() if sparse.issparse(features) else np.asarray(features, dtype=np.float64)
+    weights = np.ones(len(rows)) if weights is None else np.asarray(weights, dtype=np.float64)
+    num_clusters = int(labels.max()) + 1
+    totals = np.bincount(labels, weights=weights, minlength=num_clusters)
+    sums = np.zeros((num_clusters, rows.shape[1]))
+    np.add.at(sums, labels, rows * weights[:, np.newaxis])
+    centers = sums / np.maximum(totals, 1e-12)[:, np.newaxis]
+    return float((((rows - centers[labels]) ** 2).sum(axis=1)) @ weights)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='serve shard operations for test_optimization.py --shard-hosts')
+    parser.add_argument('--host', default='127.0.0.1', help='interface to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    server = ShardServer((args.host, args.port), ShardHandler)
+    print("Serving shard operations on {}:{}".format(*server.server_address))
+    server.serve_forever()
@@ -0,0 +1,162 @@
+import ast
+import os
+import re
+
+from config_resolver import split_test_key
+
+WORKFLOW_PREFIXES = ("workflows.",)
+FIXTURE_METHODS = ("setup", "teardown", "setup_class", "teardown_class")
+METADATA_LINE = re.compile(r"^(\s*)([A-Za-z_]+):\s*(.*)$")
+
+
+def parse_metadata(docstring):
+    metadata = {}
+    lines = (docstring or "").splitlines()
+    for idx, line in enumerate(lines):
+        if line.strip() == "Metadata:":
+            break
+    else:
+        return metadata
+    base_indent = len(line) - len(line.lstrip())
+    key_indent = None
+    for line in lines[idx + 1:]:
+        if not line.strip():
+            continue
+        indent = len(line) - len(line.lstrip())
+        if indent <= base_indent:
+            break
+        match = METADATA_LINE.match(line)
+        if not match or (key_indent is not None and indent != key_indent):
+            continue
+        key_indent = indent
+        key, value = match.group(2), match.group(3).strip()
+        if value.startswith("[") and value.endswith("]"):
+            metadata[key] = [item.strip() for item in value[1:-1].split(",") if item.strip()]
+        elif value:
+            metadata[key] = value
+    return metadata
+
+
+def dotted_name(node):
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    parts.append(node.id)
+    return ".".join(reversed(parts))
+
+
+def import_aliases(tree):
+    aliases = {}
+    for node in tree.body:
+        if isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            for alias in node.names:
+                aliases[alias.asname or alias.name] = "{}.{}".format(node.module, alias.name)
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                if alias.asname:
+                    aliases[alias.asname] = alias.name
+                else:
+                    aliases[alias.name.split(".")[0]] = alias.name.split(".")[0]
+    return aliases
+
+
+def resolve_name(name, aliases, instances):
+    head, _, rest = name.partition(".")
+    if head == "self":
+        attr, _, rest = rest.partition(".")
+        target = instances.get("self." + attr)
+        if target is None:
+            return None
+    else:
+        target = instances.get(head) or aliases.get(head)
+        if target is None:
+            return None
+    return "{}.{}".format(target, rest) if rest else target
+
+
+def instance_types(function, aliases, instances):
+    # Tracks "x = SomeWorkflow(...)" so that x.method() resolves to the class.
+    found = {}
+    for node in ast.walk(function):
+        if isinstance(node, ast.Assign) and isinstance(node.value, ast.Call):
+            target_type = resolve_name(dotted_name(node.value.func) or "", aliases, instances)
+            if not target_type or not target_type.rsplit(".", 1)[-1][:1].isupper():
+                continue
+            for target in node.targets:
+                name = dotted_name(target)
+                if name and (name.count(".") == 0 or (name.startswith("self.") and name.count(".") == 1)):
+                    found[name] = target_type
+    return found
+
+
+def function_calls(function, aliases, instances):
+    local_instances = dict(instances, **instance_types(function, aliases, instances))
+    calls, self_calls = set(), set()
+    for node in ast.walk(function):
+        if not isinstance(node, ast.Call):
+            continue
+        name = dotted_name(node.func)
+        if not name:
+            continue
+        if name.startswith("self.") and name.count(".") == 1:
+            self_calls.add(name[5:])
+        resolved = resolve_name(name, aliases, local_instances)
+        if resolved and resolved.startswith(WORKFLOW_PREFIXES):
+            calls.add(resolved)
+    return calls, self_calls
+
+
+def index_test_module(path):
+    with open(path, 'r') as file:
+        tree = ast.parse(file.read(), filename=path)
+    aliases = import_aliases(tree)
+    module_index = {}
+    for class_node in tree.body:
+        if not isinstance(class_node, ast.ClassDef):
+            continue
+        methods = {node.name: node for node in class_node.body
+                   if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+        instances = {}
+        for method in methods.values():
+            instances.update(instance_types(method, aliases, {}))
+        direct_calls = {name: function_calls(method, aliases, instances) for name, method in methods.items()}
+
+        def reachable_calls(name, seen):
+            if name in seen or name not in direct_calls:
+                return set()
+            seen.add(name)
+            calls, self_calls = direct_calls[name]
+            calls = set(calls)
+            for callee in self_calls:
+                calls |= reachable_calls(callee, seen)
+            return calls
+
+        fixture_calls = set()
+        for name in FIXTURE_METHODS:
+            fixture_calls |= reachable_calls(name, set())
+        module_index[class_node.name] = {
+            name: {
+                "metadata": parse_metadata(ast.get_docstring(method)),
+                "calls": sorted(reachable_calls(name, set()) | fixture_calls),
+                "lines": [method.lineno, method.end_lineno],
+            }
+            for name, method in methods.items() if name.startswith("test_")
+        }
+    return module_index
+
+
+def load_source_index(source_dir, test_keys):
+    modules = {}
+    index = {}
+    for key in test_keys:
+        _, module, class_name, method, _ = split_test_key(key)
+        if module not in modules:
+            path = os.path.join(source_dir, module + ".py")
+            modules[module] = index_test_module(path) if os.path.exists(path) else {}
+        entry = modules[module].get(class_name, {}).get(method)
+        if entry:
+            index[key] = entry
+    return index
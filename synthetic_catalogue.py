@@ -0,0 +1,125 @@
+import argparse
+import copy
+import json
+import os
+import random
+
+from config_resolver import VARIANT_SEPARATOR, is_test_key, split_test_key
+
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+METHODS_PER_CLASS = 8
+CLASSES_PER_MODULE = 2
+
+
+def learn_structure(config):
+    # Everything the generator samples from is taken from a real config:
+    # per-variant entry templates, how often each variant appears in a family,
+    # class entries, fatals, requirement/tag vocabularies and timeouts.
+    test_config = config.get("test_config", {})
+    variant_templates = {}
+    family_variants = {}
+    class_templates = []
+    expected_fatals = []
+    requirements = set()
+    tags = set()
+    timeouts = []
+    for key, entry in test_config.items():
+        if not is_test_key(key):
+            class_templates.append(entry)
+            continue
+        _, module, class_name, method, variant = split_test_key(key)
+        variant_templates.setdefault(variant, []).append(entry)
+        family_variants.setdefault((module, class_name, method), set()).add(variant)
+        expected_fatals.extend(entry.get("expected_fatals", []))
+        metadata = entry.get("Metadata") or {}
+        requirements.update(metadata.get("Requirements", []))
+        tags.update(metadata.get("Tags", []))
+        if "test_timeout" in entry:
+            timeouts.append(entry["test_timeout"])
+    expected_fatals = list({json.dumps(fatal, sort_keys=True): fatal for fatal in expected_fatals}.values())
+    variant_frequency = {variant: sum(variant in variants for variants in family_variants.values())
+                         / float(len(family_variants)) for variant in variant_templates}
+    return {
+        "global_config": config.get("global_config", {}),
+        "variant_templates": variant_templates,
+        "variant_frequency": variant_frequency,
+        "class_templates": class_templates,
+        "expected_fatals": expected_fatals,
+        "requirements": sorted(requirements),
+        "tags": sorted(tags),
+        "timeouts": timeouts or [3600],
+    }
+
+
+def synthetic_entry(structure, variant, rng, requirement_pool):
+    entry = copy.copy(rng.choice(structure["variant_templates"][variant]))
+    if "Metadata" in entry or rng.random() < 0.3:
+        entry["Metadata"] = {
+            "Requirements": rng.sample(requirement_pool, rng.randint(1, 3)),
+            "Tags": rng.sample(structure["tags"], rng.randint(0, min(2, len(structure["tags"])))),
+        }
+    if "expected_fatals" in entry and structure["expected_fatals"]:
+        entry["expected_fatals"] = rng.sample(structure["expected_fatals"],
+                                              min(len(entry["expected_fatals"]), len(structure["expected_fatals"])))
+    if rng.random() < 0.1:
+        entry["test_timeout"] = rng.choice(structure["timeouts"])
+    return entry
+
+
+def generate_entries(structure, num_tests, seed=0):
+    rng = random.Random(seed)
+    requirement_pool = structure["requirements"] + [
+        "{}-{}".format(rng.choice(("FEAT", "ENG")), 10000 + idx) for idx in range(max(10, int(num_tests ** 0.5)))]
+    variants = sorted(structure["variant_templates"], key=lambda variant: (variant != "", variant))
+    generated = 0
+    family = 0
+    while generated < num_tests:
+        module = family // (METHODS_PER_CLASS * CLASSES_PER_MODULE)
+        class_name = "SyntheticTest{}".format(family // METHODS_PER_CLASS % CLASSES_PER_MODULE)
+        class_prefix = "dr.draas.synthetic.test_synthetic_{}.{}".format(module, class_name)
+        if family % METHODS_PER_CLASS == 0 and structure["class_templates"]:
+            yield class_prefix, rng.choice(structure["class_templates"])
+        method = "test_synthetic_case_{}".format(family)
+        for variant in variants:
+            if generated >= num_tests:
+                break
+            if variant and rng.random() >= structure["variant_frequency"][variant]:
+                continue
+            key = "{}.{}{}".format(class_prefix, method, VARIANT_SEPARATOR + variant if variant else "")
+            yield key, synthetic_entry(structure, variant, rng, requirement_pool)
+            generated += 1
+        family += 1
+
+
+def generate_config(num_tests, seed=0, template_path=DEFAULT_TEMPLATE):
+    with open(template_path, 'r') as file:
+        structure = learn_structure(json.load(file))
+    return {"global_config": structure["global_config"],
+            "test_config": dict(generate_entries(structure, num_tests, seed))}
+
+
+def write_config(path, num_tests, seed=0, template_path=DEFAULT_TEMPLATE):
+    # Streams entries to disk so a million-test config never sits in memory.
+    with open(template_path, 'r') as file:
+        structure = learn_structure(json.load(file))
+    with open(path, 'w') as file:
+        file.write('{"global_config": ')
+        json.dump(structure["global_config"], file)
+        file.write(', "test_config": {')
+        for idx, (key, entry) in enumerate(generate_entries(structure, num_tests, seed)):
+            file.write(", " if idx else "")
+            file.write(json.dumps(key))
+            file.write(": ")
+            file.write(json.dumps(entry))
+        file.write("}}")
+    return path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='generate a synthetic config.json shaped like a real one')
+    parser.add_argument('output')
+    parser.add_argument('--tests', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--template', default=DEFAULT_TEMPLATE)
+    args = parser.parse_args()
+    write_config(args.output, args.tests, args.seed, args.template)
@@ -1,12 +1,53 @@
-import json
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.cluster import KMeans
+import argparse
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
+import numpy_backend
+import profiling
+from profiling import span
+from config_store import ConfigStore, canonical_json
+from field_vectors import FIELD_ANALYZERS, FIELDS, FieldVectors, field_payload, field_texts, parse_field_weights
+from config_resolver import is_test_key, resolve_test_case, resolve_test_cases
+from coverage_selection import build_coverage, select_within_budget
+from coverage_check import check_plan, print_check
+from covering_array import select_covering_array
+from representatives import STRATEGIES, align_coverage, choose_representatives
+from catalogue import Catalogue
+from projection import METHODS as PROJECTION_METHODS, Projection, load_projection
+from hashing_vectorizer import DEFAULT_FEATURES, compact_columns, load_document_frequencies
+from cost_aggregation import clustering_costs, group_costs
+from sharded_clustering import sharded_kmeans
+from failure_history import failure_scores, record_run
+from change_impact import select_impacted_tests
+from adaptive_runner import command_runner, stub_runner, execute_adaptive
+from testbed_scheduler import load_pools, schedule_tests, print_plan
+
+# Below this many test cases the NumPy backend is used and sklearn is never
+# imported. End to end on synthetic catalogues, NumPy took 0.7s against
+# sklearn's 1.5s at 1,900 tests and 2.0s against 2.9s at 5,000; they cross
+# near 8,000. The margin covers larger vocabularies, which NumPy keeps dense.
+SKLEARN_MIN_TEST_CASES = 5000
+# --shards clusters vectors rather than similarity rows, so without
+# --reduce-dims it projects to this many dimensions.
+DEFAULT_SHARD_DIMS = 64
+DEFAULT_CONFIG_PATH = '/home/rangu.ushasri/nutest-py3-tests/testcases/dr/draas/rpj_type_test_failover/config.json'
+
+# Largest component split by complete linkage, whose m^2 / 2 distances take
+# 16 MB here; larger ones are split on the sparse neighbour graph.
+MAX_LINKAGE_ROWS = 2000
+# Checking one candidate pair of similarity_graph costs about as much as ten
+# entries of a plain sparse product.
+PAIR_VERIFY_COST = 10
+
+def use_sklearn(num_test_cases):
+    return num_test_cases >= SKLEARN_MIN_TEST_CASES
+
 def load_config(config_path):
+    # Identical subtrees are loaded once and shared; see config_store.py.
     with open(config_path, 'r') as file:
-        config = json.load(file)
+        config = ConfigStore().load(file)
     return config
 
 def extract_test_cases(config):
@@ -15,55 +56,580 @@ def extract_test_cases(config):
 
 def combine_attributes(test_case):
     attributes = []
-    attributes.append(json.dumps(test_case.get("resource_spec", "")))
-    attributes.append(json.dumps(test_case.get("expected_fatals", "")))
-    attributes.append(json.dumps(test_case.get("Metadata", "")))
+    attributes.append(canonical_json(test_case.get("resource_spec", "")))
+    attributes.append(canonical_json(test_case.get("expected_fatals", "")))
+    attributes.append(canonical_json(test_case.get("Metadata", "")))
     return " ".join(attributes)
 
-def calculate_similarity(test_cases):
+def fit_vectors(test_cases):
+    test_case_keys = list(test_cases.keys())
+    with span("combine_attributes") as stage:
+        test_case_texts = [combine_attributes(test_cases[key]) for key in test_case_keys]
+        stage.count(len(test_case_texts))
+
+    with span("tfidf_fit") as stage:
+        if use_sklearn(len(test_case_texts)):
+            from sklearn.feature_extraction.text import TfidfVectorizer
+        else:
+            TfidfVectorizer = numpy_backend.TfidfVectorizer
+        vectorizer = TfidfVectorizer()
+        vectors = vectorizer.fit_transform(test_case_texts)
+        stage.count(len(vectorizer.vocabulary_))
+    return vectorizer, vectors, test_case_keys
+
+def collapse_duplicates(texts):
+    # Identical feature payloads become one row weighted by how often it occurs;
+    # inverse maps every original row back to its unique row.
+    row_of = {}
+    inverse = np.empty(len(texts), dtype=np.int64)
+    unique_texts = []
+    for idx, text in enumerate(texts):
+        digest = hashlib.blake2b(text.encode(), digest_size=16).digest()
+        row = row_of.get(digest)
+        if row is None:
+            row = row_of[digest] = len(unique_texts)
+            unique_texts.append(text)
+        inverse[idx] = row
+    return unique_texts, np.bincount(inverse).astype(np.float64), inverse
+
+def weighted_tfidf(texts, weights, analyzer=None):
+    # TF-IDF over unique texts whose document frequencies still count every
+    # duplicate, so the vectors equal those of the uncollapsed corpus. Returns
+    # the vectors and the term of each column.
+    if not use_sklearn(int(weights.sum())):
+        vectorizer = numpy_backend.TfidfVectorizer(analyzer)
+        return vectorizer.fit_transform(texts, weights), list(vectorizer.get_feature_names_out())
+    from sklearn.feature_extraction.text import CountVectorizer
+    from sklearn.preprocessing import normalize
+    vectorizer = CountVectorizer(analyzer=analyzer or 'word')
+    counts = vectorizer.fit_transform(texts)
+    document_frequency = (counts > 0).T @ weights
+    idf = np.log((1.0 + weights.sum()) / (1.0 + document_frequency)) + 1.0
+    return normalize(counts.multiply(idf).tocsr()), list(vectorizer.get_feature_names_out())
+
+def fit_field_vectors(payloads, weights):
+    # One TF-IDF per field; large catalogues fit the fields in parallel.
+    texts = field_texts(payloads)
+    jobs = {field: (texts[field], weights, FIELD_ANALYZERS[field]) for field in FIELDS if any(texts[field])}
+    workers = min(len(jobs), os.cpu_count() or 1)
+    if use_sklearn(int(weights.sum())) and workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            blocks = dict(zip(jobs, pool.map(weighted_tfidf, *zip(*jobs.values()))))
+    else:
+        blocks = {field: weighted_tfidf(*job) for field, job in jobs.items()}
+    return FieldVectors(blocks)
+
+def fit_unique_vectors(test_cases, field_weights=None, projection=None, document_frequencies=None,
+                       featurize_workers=1):
     test_case_keys = list(test_cases.keys())
-    test_case_texts = [combine_attributes(test_cases[key]) for key in test_case_keys]
+    with span("combine_attributes") as stage:
+        if field_weights is None:
+            test_case_texts = [combine_attributes(test_cases[key]) for key in test_case_keys]
+        else:
+            test_case_texts = [field_payload(test_cases[key]) for key in test_case_keys]
+        stage.count(len(test_case_texts))
+
+    with span("collapse_duplicates") as stage:
+        unique_texts, weights, inverse = collapse_duplicates(test_case_texts)
+        stage.count(len(unique_texts))
+
+    with span("tfidf_fit") as stage:
+        if document_frequencies is not None:
+            # The statistics already count every test, duplicates included.
+            vectors, terms = compact_columns(document_frequencies.transform(unique_texts, featurize_workers))
+            if not use_sklearn(len(test_case_keys)) and projection is None:
+                vectors = vectors.toarray()
+        elif field_weights is None:
+            vectors, terms = weighted_tfidf(unique_texts, weights)
+        else:
+            field_vectors = fit_field_vectors(unique_texts, weights)
+            vectors, terms = field_vectors.combine(field_weights), field_vectors.terms()
+            if not use_sklearn(len(test_case_keys)) and projection is None:
+                vectors = vectors.toarray()
+        stage.count(vectors.shape[1])
 
-    vectorizer = TfidfVectorizer().fit_transform(test_case_texts)
-    cosine_sim_matrix = cosine_similarity(vectorizer)
+    if projection is not None:
+        with span("projection") as stage:
+            if not projection.fits(terms):
+                projection.fit(vectors, terms, weights)
+            vectors = projection.transform(vectors, terms)
+            stage.count(vectors.shape[1])
+    return vectors, weights, inverse, test_case_keys
 
-    return cosine_sim_matrix, test_case_keys
+def cosine_similarity(vectors):
+    with span("cosine_similarity") as stage:
+        stage.count(vectors.shape[0] ** 2)
+        # Sparse vectors come from sklearn, fitted over a large catalogue that
+        # may still collapse to fewer unique rows.
+        if use_sklearn(vectors.shape[0]) or not isinstance(vectors, np.ndarray):
+            from sklearn.metrics.pairwise import cosine_similarity as sklearn_cosine_similarity
+            return sklearn_cosine_similarity(vectors)
+        return numpy_backend.cosine_similarity(vectors)
 
-def kmeans_clustering(similarity_matrix, test_case_keys, num_clusters=4):
-    kmeans = KMeans(n_clusters=num_clusters, random_state=0).fit(similarity_matrix)
+def label_groups(labels, test_case_keys, num_clusters=None):
+    if num_clusters is None:
+        num_clusters = int(labels.max()) + 1 if len(labels) else 0
     clusters = {i: [] for i in range(num_clusters)}
-    for idx, label in enumerate(kmeans.labels_):
+    for idx, label in enumerate(labels):
         clusters[label].append(test_case_keys[idx])
     return clusters
 
-def measure_execution_time(groups, test_cases, execution_times):
-    normal_execution_time = sum(execution_times.values())
-    optimized_execution_time = 0
+def kmeans_labels(similarity_matrix, num_clusters=4, weights=None, inverse=None):
+    features = similarity_matrix
+    if weights is not None:
+        # A duplicated row is also a duplicated column of the full matrix, so
+        # scaling unique columns by sqrt(count) keeps every distance unchanged.
+        features = similarity_matrix * np.sqrt(weights)
+    return kmeans_fit(features, num_clusters, weights, inverse)
+
+def kmeans_fit(features, num_clusters=4, weights=None, inverse=None):
+    # k-means over feature rows: similarity rows, or projected vectors.
+    if weights is not None:
+        num_clusters = min(num_clusters, len(weights))
+    with span("kmeans") as stage:
+        stage.count(features.shape[0])
+        if use_sklearn(features.shape[0] if inverse is None else len(inverse)):
+            from sklearn.cluster import KMeans
+        else:
+            KMeans = numpy_backend.KMeans
+        kmeans = KMeans(n_clusters=num_clusters, random_state=0).fit(features, sample_weight=weights)
+    return kmeans.labels_ if inverse is None else kmeans.labels_[inverse]
+
+def kmeans_clustering(similarity_matrix, test_case_keys, num_clusters=4, weights=None, inverse=None):
+    if weights is not None:
+        num_clusters = min(num_clusters, len(weights))
+    labels = kmeans_labels(similarity_matrix, num_clusters, weights, inverse)
+    return label_groups(labels, test_case_keys, num_clusters)
+
+def prefix_filter(matrix, threshold):
+    # All-pairs prefix filtering. Columns are ranked most frequent first, and
+    # each row's leading entries, while they alone bound its dot product with
+    # any unit row below threshold, form its unindexed prefix. A pair reaching
+    # threshold then shares an indexed (rarer) term of either row. Returns the
+    # ranked rows, their indexed suffixes and each row's prefix norm and first
+    # indexed column.
+    from scipy import sparse
+    num_rows, num_columns = matrix.shape
+    rank = np.empty(num_columns, dtype=np.int64)
+    rank[np.argsort(-np.bincount(matrix.indices, minlength=num_columns), kind='stable')] = np.arange(num_columns)
+    ranked = sparse.csr_matrix((matrix.data.copy(), rank[matrix.indices], matrix.indptr.copy()), shape=matrix.shape)
+    ranked.sort_indices()
+    maxima = np.zeros(num_columns)
+    np.maximum.at(maxima, ranked.indices, np.abs(ranked.data))
+    lengths = np.diff(ranked.indptr)
+    row_starts = np.repeat(ranked.indptr[:-1], lengths)
+
+    def running(values):
+        # Running sums restarted at every row.
+        totals = np.concatenate([[0.0], np.cumsum(values)])
+        return totals[1:] - totals[row_starts]
+
+    squares = np.concatenate([[0.0], np.cumsum(ranked.data ** 2)])
+    bounds = np.minimum(running(np.abs(ranked.data) * maxima[ranked.indices]), np.sqrt(running(ranked.data ** 2)))
+    prefix = bounds < threshold
+    prefix_counts = np.concatenate([[0], np.cumsum(prefix)])
+    boundary = ranked.indptr[:-1] + prefix_counts[ranked.indptr[1:]] - prefix_counts[ranked.indptr[:-1]]
+    prefix_norms = np.sqrt(squares[boundary] - squares[ranked.indptr[:-1]])
+    first_indexed = np.full(num_rows, num_columns, dtype=np.int64)
+    indexed = boundary < ranked.indptr[1:]
+    first_indexed[indexed] = ranked.indices[boundary[indexed]]
+    suffix = sparse.csr_matrix((np.where(prefix, 0.0, ranked.data), ranked.indices.copy(), ranked.indptr.copy()),
+                               shape=matrix.shape)
+    suffix.eliminate_zeros()
+    return ranked, suffix, prefix_norms, first_indexed
+
+def product_pairs(block, earlier_rows, start, threshold):
+    # Pairs of block rows (numbered from start) and earlier rows with dot
+    # product >= threshold, from the full product.
+    from scipy import sparse
+    if sparse.issparse(block):
+        product = (block @ earlier_rows.T).tocoo()
+        later, earlier = product.row[product.data >= threshold], product.col[product.data >= threshold]
+    else:
+        later, earlier = np.nonzero(block @ earlier_rows.T >= threshold)
+    keep = earlier < later + start
+    return later[keep] + start, earlier[keep]
 
-    for group in groups.values():
-        max_time = max(execution_times[test_case] for test_case in group)
-        optimized_execution_time += max_time
+def similarity_graph(vectors, threshold, chunk_size=1024, verify_size=1 << 20):
+    # Sparse graph of pairs with cosine >= threshold, each pair once, from
+    # its later row. Sparse rows are compared only where prefix filtering
+    # finds a candidate pair, so the work follows the rare terms rows share
+    # rather than n x n; dense rows, and thresholds so low that most pairs
+    # are candidates, block by block.
+    from scipy import sparse
+    num_rows = vectors.shape[0]
+    rows, columns = [], []
+    if sparse.issparse(vectors):
+        matrix = sparse.csr_matrix(vectors, dtype=np.float64)
+        matrix.sum_duplicates()
+        ranked, suffix, prefix_norms, first_indexed = prefix_filter(matrix, threshold)
+        counts = np.bincount(ranked.indices, minlength=ranked.shape[1]).astype(np.float64)
+        filtered = 2 * counts @ np.bincount(suffix.indices, minlength=ranked.shape[1]) < counts @ counts
+        prefix = ranked - suffix
+        indexed = suffix.T.tocsr()
+        # Every stored entry's key, in order, and running squared norms: the
+        # norm of a row over the columns ranked before any given column.
+        keys = np.repeat(np.arange(num_rows, dtype=np.int64), np.diff(ranked.indptr)) * ranked.shape[1] + ranked.indices
+        squares = np.concatenate([[0.0], np.cumsum(ranked.data ** 2)])
+    else:
+        ranked = np.asarray(vectors, dtype=np.float64)
+        filtered = False
+    for start in range(0, num_rows, chunk_size):
+        block = ranked[start:start + chunk_size]
+        end = start + block.shape[0]
+        if filtered:
+            # Against the earlier rows' indexed terms, then dropped where the
+            # earlier row's prefix norm times the later row's norm over the
+            # columns before the earlier row's first indexed one stays short.
+            candidates = (block @ indexed[:, :end]).tocoo()
+            keep = candidates.col < candidates.row + start
+            later, earlier, partial = candidates.row[keep] + start, candidates.col[keep], candidates.data[keep]
+            position = np.searchsorted(keys, later * ranked.shape[1] + first_indexed[earlier])
+            bound = prefix_norms[earlier] * np.sqrt(np.maximum(squares[position] - squares[ranked.indptr[later]], 0.0))
+            keep = partial + bound >= threshold
+            later, earlier, partial = later[keep], earlier[keep], partial[keep]
+        if not filtered or len(later) * PAIR_VERIFY_COST > block.shape[0] * end:
+            later, earlier = product_pairs(block, ranked[:end], start, threshold)
+            rows.append(later)
+            columns.append(earlier)
+            continue
+        for offset in range(0, len(later), verify_size):
+            pairs = slice(offset, offset + verify_size)
+            prefix_products = ranked[later[pairs]].multiply(prefix[earlier[pairs]]).sum(axis=1)
+            exact = partial[pairs] + np.asarray(prefix_products).ravel()
+            rows.append(later[pairs][exact >= threshold])
+            columns.append(earlier[pairs][exact >= threshold])
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    columns = np.concatenate(columns) if columns else np.zeros(0, dtype=np.int64)
+    return sparse.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, columns)), shape=(num_rows,) * 2)
 
-    return normal_execution_time, optimized_execution_time
+def star_pieces(graph, weights):
+    # Greedy star cover of a thresholded graph: the unassigned row with the
+    # heaviest neighbourhood seeds a piece with its unassigned neighbours, so
+    # every member is within threshold of its piece's seed. Linear in edges.
+    pieces = np.full(graph.shape[0], -1, dtype=np.int64)
+    num_pieces = 0
+    for seed in np.argsort(-(graph @ weights), kind='stable').tolist():
+        if pieces[seed] >= 0:
+            continue
+        neighbours = graph.indices[graph.indptr[seed]:graph.indptr[seed + 1]]
+        pieces[neighbours[pieces[neighbours] < 0]] = num_pieces
+        pieces[seed] = num_pieces
+        num_pieces += 1
+    return pieces + 1
 
-def main(config_path):
-    config = load_config(config_path)
-    test_cases = extract_test_cases(config)
+def split_oversized_components(vectors, graph, labels, weights, threshold, max_cluster_size):
+    # Complete linkage cut at 1 - threshold keeps every pair inside a piece
+    # above the similarity threshold. It needs all m^2 member distances, so
+    # components above MAX_LINKAGE_ROWS rows are split on their thresholded
+    # subgraph instead.
+    from scipy.cluster.hierarchy import fcluster, linkage
+    from scipy.spatial.distance import squareform
+    from scipy import sparse
+    graph = (graph + graph.T).tocsr()
+    sizes = np.bincount(labels, weights=weights)
+    next_label = labels.max() + 1
+    for component in np.flatnonzero(sizes > max_cluster_size):
+        members = np.flatnonzero(labels == component)
+        if len(members) < 2:
+            continue
+        if len(members) > MAX_LINKAGE_ROWS:
+            pieces = star_pieces(graph[members][:, members].tocsr(), weights[members])
+        else:
+            # Distances from the members' own product, never their dense rows.
+            similarity = vectors[members] @ vectors[members].T
+            similarity = similarity.toarray() if sparse.issparse(similarity) else np.asarray(similarity)
+            distances = np.clip(1.0 - similarity, 0.0, 2.0)
+            np.fill_diagonal(distances, 0.0)
+            pieces = fcluster(linkage(squareform(distances, checks=False), method='complete'),
+                              t=1.0 - threshold, criterion='distance')
+        labels[members] = next_label + pieces - 1
+        next_label += pieces.max()
+    return labels
 
-    execution_times = {key: test_cases[key].get('test_timeout', 0) for key in test_cases.keys()}
+def threshold_labels(vectors, threshold=0.9, max_cluster_size=None, weights=None, inverse=None):
+    from scipy.sparse.csgraph import connected_components
+    if weights is None:
+        weights = np.ones(vectors.shape[0])
+    with span("neighbour_graph") as stage:
+        graph = similarity_graph(vectors, threshold)
+        stage.count(graph.nnz)
+    with span("connected_components") as stage:
+        _, labels = connected_components(graph, directed=False)
+        if max_cluster_size:
+            labels = split_oversized_components(vectors, graph, labels, weights, threshold, max_cluster_size)
+        _, labels = np.unique(labels, return_inverse=True)
+        stage.count(int(labels.max()) + 1 if len(labels) else 0)
+    return labels if inverse is None else labels[inverse]
 
-    similarity_matrix, test_case_keys = calculate_similarity(test_cases)
-    num_clusters = 8
-    clusters = kmeans_clustering(similarity_matrix, test_case_keys, num_clusters)
+def threshold_clustering(vectors, test_case_keys, threshold=0.9, max_cluster_size=None, weights=None, inverse=None):
+    return label_groups(threshold_labels(vectors, threshold, max_cluster_size, weights, inverse), test_case_keys)
+
+def measure_execution_time(labels, costs, selected=None):
+    # labels and costs are per test id; selected, if given, is an id array.
+    normal_execution_time = costs.sum().item()
+
+    if selected is not None:
+        return normal_execution_time, costs[selected].sum().item()
+
+    _, _, max_times, _ = group_costs(labels, costs)
+    return normal_execution_time, max_times.sum().item()
+
+def select_representatives(groups, execution_times):
+    return [max(group, key=lambda test_case: execution_times[test_case]) for group in groups.values() if group]
+
+def order_ids_by_failure_score(test_ids, scores):
+    return test_ids[np.argsort(-scores[test_ids], kind='stable')]
+
+def main(config_path, *, num_clusters=8, pools_path=None, runner=None, workers=1, budget_hours=None, testbeds=1,
+         history_path=None, changed_since=None, changed_lines=False, impact_index=None,
+         threshold=None, max_cluster_size=None, strategy="longest", max_representatives=1, spread=None,
+         check_coverage=False, field_weights=None, sweep_clusters=None, reduce_dims=None, reduction="random",
+         projection_path=None, hashing_path=None, hash_features=DEFAULT_FEATURES, featurize_workers=1,
+         shards=None, shard_hosts=None, covering_strength=None):
+    with span("load") as stage:
+        config = load_config(config_path)
+        test_cases = extract_test_cases(config)
+        stage.count(len(test_cases))
+
+    document_frequencies = None
+    if hashing_path:
+        # Synced with the whole catalogue, before any change-impact filtering.
+        with span("document_frequencies") as stage:
+            document_frequencies = load_document_frequencies(hashing_path, hash_features)
+            changed, removed = document_frequencies.sync({key: combine_attributes(test_cases[key])
+                                                          for key in test_cases}, featurize_workers)
+            stage.count(len(changed) + len(removed))
+        if changed or removed:
+            document_frequencies.save(hashing_path)
+        print("Document frequencies: {} tests added or changed, {} removed".format(len(changed), len(removed)))
+
+    if changed_since:
+        with span("change_impact"):
+            impacted, functions = select_impacted_tests(list(test_cases.keys()), os.path.dirname(config_path) or '.',
+                                                        changed_since, index_path=impact_index, by_lines=changed_lines)
+        print("Changed functions: {}".format(', '.join(functions) or 'none'))
+        print("Impacted tests: {} of {}".format(len(impacted), len(test_cases)))
+        test_cases = {key: test_cases[key] for key in impacted}
+        if not test_cases:
+            return
+        num_clusters = min(num_clusters, len(test_cases))
+
+    with span("catalogue") as stage:
+        # Costs and coverage use the resolved entries: timeouts and topologies
+        # are mostly inherited from the global, class and base-method layers.
+        resolved_tests = {key: resolve_test_case(config, key) for key in test_cases if is_test_key(key)}
+        catalogue = Catalogue(test_cases, resolved_tests)
+        stage.count(len(catalogue))
+    costs = catalogue.cost
+    execution_times = dict(zip(catalogue.names.strings, costs.tolist()))
+
+    if shards and not reduce_dims and threshold is None:
+        reduce_dims = DEFAULT_SHARD_DIMS
+    projection = None
+    if reduce_dims:
+        projection = load_projection(projection_path, reduction, reduce_dims) or Projection(reduction, reduce_dims)
+
+    with span("calculate_similarity"):
+        vectors, weights, inverse, _ = fit_unique_vectors(test_cases, field_weights, projection,
+                                                         document_frequencies, featurize_workers)
+        if threshold is None:
+            # Projected vectors are clustered directly instead of n x n
+            # similarity rows.
+            features = vectors if projection is not None else cosine_similarity(vectors) * np.sqrt(weights)
+    if projection_path and projection is not None and (projection.updated or not os.path.exists(projection_path)):
+        projection.save(projection_path)
+    if threshold is not None:
+        labels = threshold_labels(vectors, threshold, max_cluster_size, weights, inverse)
+    elif shards:
+        with span("sharded_kmeans") as stage:
+            stage.count(shards)
+            labels = sharded_kmeans(features, num_clusters, weights, shards, hosts=shard_hosts)[0][inverse]
+    else:
+        labels = kmeans_fit(features, num_clusters, weights, inverse)
+    # Name-keyed clusters for output and for the stages that take test names.
+    clusters = catalogue.groups(labels)
 
     print("Groups of similar test cases:")
     for cluster_id, group in clusters.items():
         print("Cluster {}: {}".format(cluster_id, ', '.join(group)))
 
-    normal_time, optimized_time = measure_execution_time(clusters, test_cases, execution_times)
+    if sweep_clusters and threshold is None:
+        with span("cluster_sweep") as stage:
+            stage.count(len(sweep_clusters))
+            label_matrix = np.array([kmeans_fit(features, k, weights, inverse) for k in sweep_clusters])
+            sweep_times, _ = clustering_costs(label_matrix, costs)
+        for k, sweep_time in zip(sweep_clusters, sweep_times.tolist()):
+            print("Clusters {}: Optimized Execution Time {} seconds".format(k, sweep_time))
+
+    scores = None
+    if history_path:
+        with span("failure_scores"):
+            scores = np.array(list(failure_scores(history_path, catalogue.names.strings).values()))
+    selected = None
+    if budget_hours is not None:
+        with span("budget_selection") as stage:
+            selected_names, coverage, uncovered = select_within_budget(resolved_tests, execution_times,
+                                                                       os.path.dirname(config_path), budget_hours,
+                                                                       testbeds, clusters)
+            stage.count(len(resolved_tests))
+        selected = catalogue.ids_of(selected_names)
+        if scores is not None:
+            selected = order_ids_by_failure_score(selected, scores)
+        print("Selected within {} hours on {} testbeds: {}".format(budget_hours, testbeds,
+                                                                   ', '.join(catalogue.names_of(selected))))
+        print("Weighted Coverage: {:.1%}".format(coverage))
+        if uncovered:
+            print("Uncovered Items: {}".format(', '.join(uncovered)))
+    elif covering_strength:
+        with span("covering_array") as stage:
+            selected, families, combinations = select_covering_array(catalogue, resolved_tests, covering_strength)
+            stage.count(len(resolved_tests))
+        if scores is not None:
+            selected = order_ids_by_failure_score(selected, scores)
+        print("Covering {}-wise variant combinations: {}".format(covering_strength,
+                                                                 ', '.join(catalogue.names_of(selected))))
+        print("Variants: {} of {} in {} families cover all {} combinations".format(
+            len(selected), len(resolved_tests), families, combinations))
+    elif strategy != "longest" or max_representatives > 1 or scores is not None:
+        with span("select_representatives") as stage:
+            stage.count(len(clusters))
+            coverage = None
+            if strategy == "cover":
+                coverage_keys, _, indptr, indices, _ = build_coverage(resolved_tests, os.path.dirname(config_path))
+                coverage = align_coverage(coverage_keys, indptr, indices, catalogue.names.strings)
+            selected = choose_representatives(labels, costs, vectors[inverse], strategy, max_representatives,
+                                              spread, coverage, scores, catalogue.runnable)
+        if scores is not None:
+            selected = order_ids_by_failure_score(selected, scores)
+
+    if scores is not None:
+        print("Run order by failure likelihood:")
+        for test_id in selected:
+            print("{:.3f} {}".format(scores[test_id], catalogue.names[test_id]))
+
+    with span("measure_execution_time") as stage:
+        stage.count(len(costs))
+        normal_time, optimized_time = measure_execution_time(labels, costs, selected)
     print("Normal Execution Time: {} seconds".format(normal_time))
     print("Optimized Execution Time: {} seconds".format(optimized_time))
 
+    if selected is None:
+        selected = choose_representatives(labels, costs, runnable=catalogue.runnable)
+    if check_coverage:
+        with span("coverage_check") as stage:
+            suite_tests = resolve_test_cases(config)
+            stage.count(len(suite_tests))
+            print_check(check_plan(suite_tests, catalogue.names_of(selected),
+                                   {key: suite_tests[key].get('test_timeout', 0) for key in suite_tests},
+                                   os.path.dirname(config_path)))
+
+    if pools_path:
+        pools = load_pools(pools_path)
+        with span("schedule_tests") as stage:
+            stage.count(len(selected))
+            plan, unschedulable = schedule_tests(catalogue.names_of(selected), config, pools)
+        print_plan(plan, pools, unschedulable)
+
+    if runner:
+        # The selected tests, in run order, are what gets dispatched.
+        score_map = dict(zip(catalogue.names.strings, scores.tolist())) if scores is not None else None
+        with span("adaptive_run"):
+            results, _, _ = execute_adaptive(clusters, execution_times, runner, workers,
+                                             catalogue.names_of(selected), score_map)
+        if history_path:
+            record_run(history_path, {test_case: result[0] for test_case, result in results.items()})
+
 if __name__ == "__main__":
-    config_path = '/home/rangu.ushasri/nutest-py3-tests/testcases/dr/draas/rpj_type_test_failover/config.json'
-    main(config_path)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default=DEFAULT_CONFIG_PATH)
+    parser.add_argument('--clusters', type=int, default=8)
+    parser.add_argument('--pools', help='testbed pool definitions; schedules the selected tests over them')
+    parser.add_argument('--adaptive', action='store_true', help='run representatives and expand clusters whose representative fails')
+    parser.add_argument('--runner', help='runner command template for --adaptive, e.g. "nutest run {test}"; defaults to the local stub')
+    parser.add_argument('--runner-timeout', type=float, metavar='SECONDS',
+                        help='kill a --runner command after this long; defaults to the test\'s resolved test_timeout')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--stub-fail-rate', type=float, default=0.0)
+    parser.add_argument('--budget-hours', type=float, help='select the highest-coverage tests that fit in this many hours')
+    parser.add_argument('--testbeds', type=int, default=1, help='testbeds available to the --budget-hours selection')
+    parser.add_argument('--history', help='failure history store; picks and orders representatives by failure likelihood')
+    parser.add_argument('--changed-since', help='git revision; restrict clustering to tests calling functions changed since it')
+    parser.add_argument('--changed-lines', action='store_true', help='map --changed-since diffs to functions by changed line ranges')
+    parser.add_argument('--impact-index', help='persisted call-graph index for --changed-since, updated incrementally')
+    parser.add_argument('--threshold', type=float, help='cluster by connected components of pairs with cosine >= threshold instead of k-means')
+    parser.add_argument('--max-cluster-size', type=int, help='split larger --threshold components by complete linkage')
+    parser.add_argument('--representatives', choices=STRATEGIES, default='longest',
+                        help='per-cluster pick: longest test, medoid nearest the centroid, or cheapest tests covering the cluster')
+    parser.add_argument('--max-representatives', type=int, default=1, help='extra representatives for spread-out clusters, farthest first')
+    parser.add_argument('--spread', type=float, help='cosine similarity to a representative at which a member counts as represented')
+    parser.add_argument('--check-coverage', action='store_true', help='list items the full suite covers that the selected tests miss')
+    parser.add_argument('--fields', nargs='?', const='', metavar='WEIGHTS',
+                        help='vectorise resource_spec, expected_fatals, Metadata and test_args separately, e.g. "resource_spec=3,expected_fatals=0.5"')
+    parser.add_argument('--sweep-clusters', type=int, nargs='+', metavar='K', help='also report the optimized time for each of these k-means cluster counts')
+    parser.add_argument('--reduce-dims', type=int, metavar='D', help='project vectors to D dense dimensions and cluster those')
+    parser.add_argument('--reduction', choices=PROJECTION_METHODS, default='random', help='sparse random projection or randomized SVD for --reduce-dims')
+    parser.add_argument('--projection', help='saved projection for --reduce-dims; fitted and written here on first use, reused afterwards')
+    parser.add_argument('--hashing', metavar='PATH',
+                        help='feature-hashed TF-IDF with document frequencies kept here and updated only for changed tests')
+    parser.add_argument('--hash-features', type=int, default=DEFAULT_FEATURES, help='hashed feature columns for --hashing')
+    parser.add_argument('--featurize-workers', type=int, default=os.cpu_count() or 1,
+                        help='processes hashing large --hashing catalogues into shared memory')
+    parser.add_argument('--shards', type=int,
+                        help='map-reduce k-means over this many shards of the projected vectors; implies --reduce-dims 64')
+    parser.add_argument('--shard-hosts', nargs='+', metavar='HOST:PORT',
+                        help='remote sharded_clustering.py workers for --shards instead of local processes')
+    parser.add_argument('--covering-array', type=int, nargs='?', const=2, metavar='T',
+                        help='per test family, the cheapest variants covering every T-wise combination of site, hypervisors, hypervisor version and IPAM (pairwise by default)')
+    parser.add_argument('--profile', help='write a per-stage trace here (Chrome trace, or speedscope for *.speedscope.json)')
+    args = parser.parse_args()
+    if args.covering_array is not None and args.covering_array < 1:
+        parser.error('--covering-array needs T >= 1')
+    if args.covering_array and args.budget_hours is not None:
+        parser.error('--covering-array and --budget-hours are separate selections')
+    if args.hashing and args.fields is not None:
+        parser.error('--hashing vectorises the combined attributes and cannot be used with --fields')
+    field_weights = None
+    if args.fields is not None:
+        try:
+            field_weights = parse_field_weights(args.fields)
+        except ValueError as error:
+            parser.error('--fields: {}'.format(error))
+
+    runner = None
+    if args.adaptive:
+        runner = command_runner(args.runner, args.runner_timeout) if args.runner else stub_runner(args.stub_fail_rate)
+    if args.profile:
+        profiling.enable()
+    main(args.config,
+         num_clusters=args.clusters,
+         pools_path=args.pools,
+         runner=runner,
+         workers=args.workers,
+         budget_hours=args.budget_hours,
+         testbeds=args.testbeds,
+         history_path=args.history,
+         changed_since=args.changed_since,
+         changed_lines=args.changed_lines,
+         impact_index=args.impact_index,
+         threshold=args.threshold,
+         max_cluster_size=args.max_cluster_size,
+         strategy=args.representatives,
+         max_representatives=args.max_representatives,
+         spread=args.spread,
+         check_coverage=args.check_coverage,
+         field_weights=field_weights,
+         sweep_clusters=args.sweep_clusters,
+         reduce_dims=args.reduce_dims,
+         reduction=args.reduction,
+         projection_path=args.projection,
+         hashing_path=args.hashing,
+         hash_features=args.hash_features,
+         featurize_workers=args.featurize_workers,
+         shards=args.shards or (len(args.shard_hosts) if args.shard_hosts else None),
+         shard_hosts=args.shard_hosts,
+         covering_strength=args.covering_array)
+    if args.profile:
+        profiler = profiling.disable()
+        profiler.export(args.profile)
+        print(profiler.summary())
@@ -0,0 +1,93 @@
+import heapq
+import json
+
+from config_resolver import resolve_test_case
+
+
+def load_pools(pools_path):
+    with open(pools_path, 'r') as file:
+        pools = json.load(file)
+    return pools.get("pools", [])
+
+
+def spec_matches(pattern, actual):
+    if isinstance(pattern, dict):
+        return isinstance(actual, dict) and all(
+            key in actual and spec_matches(value, actual[key]) for key, value in pattern.items())
+    if isinstance(pattern, list):
+        return isinstance(actual, list) and all(item in actual for item in pattern)
+    return pattern == actual
+
+
+def compatible_pools(resource_spec, pools):
+    return [pool["name"] for pool in pools
+            if any(spec_matches(pool["match"], spec) for spec in resource_spec)]
+
+
+def schedule_tests(selected_tests, config, pools):
+    # Longest-processing-time-first list scheduling: every test goes to the
+    # testbed, across all compatible pools, that frees up first.
+    capacities = {pool["name"]: pool.get("capacity", 1) for pool in pools}
+    slots = {name: [(0, slot) for slot in range(capacity)] for name, capacity in capacities.items()}
+    plan = {name: [[] for _ in range(capacity)] for name, capacity in capacities.items()}
+    unschedulable = []
+
+    jobs = []
+    for test_case in selected_tests:
+        resolved = resolve_test_case(config, test_case)
+        jobs.append((resolved.get("test_timeout", 0), test_case, resolved.get("resource_spec", [])))
+    jobs.sort(key=lambda job: (-job[0], job[1]))
+
+    for duration, test_case, resource_spec in jobs:
+        candidates = [name for name in compatible_pools(resource_spec, pools) if capacities[name] > 0]
+        if not candidates:
+            unschedulable.append(test_case)
+            continue
+        pool_name = min(candidates, key=lambda name: (slots[name][0][0], name))
+        start, slot = heapq.heappop(slots[pool_name])
+        plan[pool_name][slot].append((test_case, start, start + duration))
+        heapq.heappush(slots[pool_name], (start + duration, slot))
+
+    return plan, unschedulable
+
+
+def summarize_plan(plan, pools):
+    capacities = {pool["name"]: pool.get("capacity", 1) for pool in pools}
+    summary = {}
+    for pool_name, testbeds in plan.items():
+        finish_times = [testbed[-1][2] for testbed in testbeds if testbed]
+        busy_time = sum(end - start for testbed in testbeds for _, start, end in testbed)
+        summary[pool_name] = {
+            "capacity": capacities[pool_name],
+            "tests": sum(len(testbed) for testbed in testbeds),
+            "busy_time": busy_time,
+            "makespan": max(finish_times) if finish_times else 0,
+        }
+    wall_time = max([pool["makespan"] for pool in summary.values()] or [0])
+    for pool in summary.values():
+        capacity_time = pool["capacity"] * wall_time
+        pool["utilization"] = float(pool["busy_time"]) / capacity_time if capacity_time else 0.0
+    # Pools finishing together are told apart by how fully they use their
+    # testbeds: a saturated pool needs more capacity, a half-idle one does not.
+    critical_pool = max(summary, key=lambda name: (summary[name]["makespan"], summary[name]["utilization"],
+                                                   summary[name]["busy_time"])) if summary else None
+    return summary, wall_time, critical_pool
+
+
+def print_plan(plan, pools, unschedulable):
+    summary, wall_time, critical_pool = summarize_plan(plan, pools)
+    print("Testbed schedule:")
+    for pool_name, testbeds in plan.items():
+        pool = summary[pool_name]
+        print("Pool {} (capacity {}): {} tests, makespan {} seconds, utilization {:.0%}".format(
+            pool_name, pool["capacity"], pool["tests"], pool["makespan"], pool["utilization"]))
+        for slot, testbed in enumerate(testbeds):
+            for test_case, start, end in testbed:
+                print("  testbed {} [{} - {}]: {}".format(slot, start, end, test_case))
+    for test_case in unschedulable:
+        print("No compatible testbed pool: {}".format(test_case))
+    print("Scheduled Wall Time: {} seconds".format(wall_time))
+    print("Critical Pool: {}".format(critical_pool))
+    tied = [name for name in summary if name != critical_pool and wall_time and summary[name]["makespan"] == wall_time]
+    if tied:
+        print("Also finishing at wall time: {}".format(", ".join(tied)))
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The modules under test live at the repository root, next to the nutest
+# test_*.py files this suite does not collect.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+import test_optimization
+from test_optimization import similarity_graph, split_oversized_components, star_pieces
+
+THRESHOLDS = [0.3, 0.6, 0.8, 0.9, 0.95, 0.99, 1.0]
+
+
+def random_rows(rng, signed=False):
+    num_rows, num_columns = int(rng.integers(0, 60)), int(rng.integers(1, 30))
+    rows = (rng.random((num_rows, num_columns)) < rng.uniform(0.05, 0.6)) * rng.random((num_rows, num_columns))
+    if signed:
+        rows *= np.sign(rng.random((num_rows, num_columns)) - 0.3)
+    if num_rows > 3:
+        # An empty row, including the last one, and a duplicate.
+        rows[-1] = 0
+        rows[1] = rows[0]
+    norms = np.linalg.norm(rows, axis=1)
+    norms[norms == 0] = 1.0
+    return rows / norms[:, np.newaxis]
+
+
+def brute_force_pairs(rows, threshold):
+    similarity = rows @ rows.T
+    expected = similarity >= threshold
+    np.fill_diagonal(expected, False)
+    # Pairs within rounding of the threshold may fall either way.
+    return expected, np.abs(similarity - threshold) > 1e-9
+
+
+@pytest.mark.parametrize("seed", range(100))
+@pytest.mark.parametrize("signed", [False, True])
+def test_similarity_graph_matches_brute_force(seed, signed):
+    rng = np.random.default_rng(seed)
+    rows = random_rows(rng, signed)
+    threshold = float(rng.choice(THRESHOLDS))
+    expected, decided = brute_force_pairs(rows, threshold)
+    for vectors in (sparse.csr_matrix(rows), rows):
+        graph = similarity_graph(vectors, threshold, chunk_size=int(rng.integers(1, 20)),
+                                 verify_size=int(rng.integers(1, 50)))
+        found = ((graph + graph.T) > 0).toarray()
+        assert not ((found != expected) & decided).any()
+        # Each pair once, from its later row.
+        assert not sparse.triu(graph).nnz
+
+
+def test_similarity_graph_leaves_input_unchanged():
+    rows = sparse.csr_matrix(random_rows(np.random.default_rng(0)))
+    data = rows.data.copy()
+    similarity_graph(rows, 0.9)
+    assert np.array_equal(rows.data, data)
+
+
+def component_rows(rng, num_rows):
+    # Rows near a few directions, so one threshold component splits into
+    # several pieces.
+    directions = rng.random((4, 12))
+    rows = directions[rng.integers(0, 4, num_rows)] + rng.random((num_rows, 12)) * 0.3
+    return rows / np.linalg.norm(rows, axis=1)[:, np.newaxis]
+
+
+@pytest.mark.parametrize("max_linkage_rows", [10000, 10])
+def test_split_pieces_stay_within_threshold(monkeypatch, max_linkage_rows):
+    # Complete linkage keeps every pair of a piece above threshold; the star
+    # split of larger components keeps every member above it with one seed.
+    monkeypatch.setattr(test_optimization, "MAX_LINKAGE_ROWS", max_linkage_rows)
+    rng = np.random.default_rng(1)
+    rows = component_rows(rng, 80)
+    threshold = 0.9
+    vectors = sparse.csr_matrix(rows)
+    graph = similarity_graph(vectors, threshold)
+    _, labels = connected_components(graph, directed=False)
+    labels = split_oversized_components(vectors, graph, labels, np.ones(len(rows)), threshold, 5)
+    for piece in np.unique(labels):
+        members = np.flatnonzero(labels == piece)
+        similarity = rows[members] @ rows[members].T
+        if max_linkage_rows > len(rows):
+            assert (similarity >= threshold - 1e-9).all()
+        else:
+            assert (similarity >= threshold - 1e-9).all(axis=1).any()
+
+
+def test_star_pieces_cover_every_row_once():
+    graph = sparse.csr_matrix(np.array([[0, 1, 1, 0, 0],
+                                        [1, 0, 0, 0, 0],
+                                        [1, 0, 0, 1, 0],
+                                        [0, 0, 1, 0, 0],
+                                        [0, 0, 0, 0, 0]]))
+    pieces = star_pieces(graph, np.ones(5))
+    # Row 0 or 2 seeds first (two neighbours each); the rest form their own.
+    assert pieces.min() == 1
+    assert len(np.unique(pieces)) == 3